@@ -10,9 +10,27 @@ Tile layout: Column-by-column, top-to-bottom
 - Column 18: tiles 76185-76202 (18 tiles)
 
 Missing tiles: 76009, 76027 (both in row 5)
+
+Output formats (--output-format):
+- png:   one PNG image (default)
+- gtiff: tiled, compressed GeoTIFF with internal overviews (needs GDAL),
+         cheap random access windows and reduced resolutions for gdal2tiles
+- vrt:   GDAL VRT mosaic (plain XML) over the original JPEGs, no pixels copied
+
+With --streaming the PNG is assembled and written one row of tiles (an
+18432x1024 strip) at a time, so the peak memory stays around 60 MB instead of
+the 1 GB canvas, whatever the grid size.
+
+With --tiles DIR the map image is skipped: every original tile is cut
+straight into the Leaflet tiles of the max zoom level and the overview
+tiles are built by raster2tiles.py (same layout as generate-tiles.sh).
 """
 
 import os
+import argparse
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from PIL import Image
 import sys
 
@@ -25,12 +43,73 @@ START_TILE = 75879
 END_TILE = 76202
 MISSING_TILES = [76009, 76027]
 OUTPUT_FILE = "original-map-18432x18432.png"
+OUTPUT_FORMATS = {"png": ".png", "gtiff": ".tif", "vrt": ".vrt"}
 
 def create_blank_tile():
     """Create a black placeholder tile for missing tiles"""
     return Image.new('RGB', (TILE_SIZE, TILE_SIZE), color='black')
 
-def assemble_map():
+def load_tile(tile_num, col, row):
+    """Load an original tile, returns the tile (or a black placeholder) and whether it was found"""
+    tile_filename = f"{tile_num}.jpg"
+    tile_path = os.path.join(TILE_DIR, tile_filename)
+
+    if tile_num in MISSING_TILES:
+        print(f"  Missing tile {tile_num} at column {col+1}, row {row+1} - using black placeholder")
+        return create_blank_tile(), False
+    if not os.path.exists(tile_path):
+        print(f"  Warning: tile {tile_num} not found at {tile_path} - using black placeholder")
+        return create_blank_tile(), False
+
+    tile = Image.open(tile_path)
+    tile.load()  # Decode now (Pillow releases the GIL while decoding)
+    # Verify tile size
+    if tile.size != (TILE_SIZE, TILE_SIZE):
+        print(f"  Warning: tile {tile_num} has unexpected size {tile.size}, resizing...")
+        tile = tile.resize((TILE_SIZE, TILE_SIZE), Image.LANCZOS)
+    return tile, True
+
+def load_tiles(workers=1, rows=None):
+    """Load the original tiles, yields (col, row, tile, found)
+
+    All tiles column by column by default; with rows only the tiles of these
+    rows, row by row. With several workers the JPEGs are decoded by a thread
+    pool and yielded in completion order; at most 2 tiles per worker are
+    decoded ahead, so the memory use does not depend on the grid size.
+    """
+    # Column-by-column, top-to-bottom layout
+    if rows is None:
+        positions = [(START_TILE + col * GRID_SIZE + row, col, row)
+                     for col in range(GRID_SIZE) for row in range(GRID_SIZE)]
+    else:
+        positions = [(START_TILE + col * GRID_SIZE + row, col, row)
+                     for row in rows for col in range(GRID_SIZE)]
+    if workers <= 1:
+        for tile_num, col, row in positions:
+            tile, found = load_tile(tile_num, col, row)
+            yield col, row, tile, found
+        return
+
+    with ThreadPoolExecutor(workers) as executor:
+        queue = iter(positions)
+        pending = {}
+
+        def submit():
+            for tile_num, col, row in queue:
+                pending[executor.submit(load_tile, tile_num, col, row)] = (col, row)
+                return
+
+        for i in range(2 * workers):
+            submit()
+        while pending:
+            done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                col, row = pending.pop(future)
+                submit()
+                tile, found = future.result()
+                yield col, row, tile, found
+
+def assemble_map(output_file=OUTPUT_FILE, workers=1):
     """Assemble the full map from individual tiles"""
     print(f"Assembling {GRID_SIZE}x{GRID_SIZE} map from {TILE_DIR}/")
     print(f"Output size: {OUTPUT_SIZE}x{OUTPUT_SIZE} pixels")
@@ -40,45 +119,126 @@ def assemble_map():
     # Create the output image
     output_image = Image.new('RGB', (OUTPUT_SIZE, OUTPUT_SIZE), color='black')
 
-    tile_num = START_TILE
     tiles_processed = 0
     tiles_missing = 0
 
-    # Column-by-column, top-to-bottom layout
-    for col in range(GRID_SIZE):
-        for row in range(GRID_SIZE):
-            tile_filename = f"{tile_num}.jpg"
-            tile_path = os.path.join(TILE_DIR, tile_filename)
+    # Load tiles (or placeholders), pasted in the order they are decoded
+    for col, row, tile, found in load_tiles(workers):
+        if found:
+            tiles_processed += 1
+        else:
+            tiles_missing += 1
 
-            # Calculate position in output image
-            x_offset = col * TILE_SIZE
-            y_offset = row * TILE_SIZE
+        # Calculate position in output image
+        x_offset = col * TILE_SIZE
+        y_offset = row * TILE_SIZE
 
-            # Load tile or use placeholder
-            if tile_num in MISSING_TILES:
-                print(f"  Missing tile {tile_num} at column {col+1}, row {row+1} - using black placeholder")
-                tile = create_blank_tile()
-                tiles_missing += 1
-            elif os.path.exists(tile_path):
-                tile = Image.open(tile_path)
-                # Verify tile size
-                if tile.size != (TILE_SIZE, TILE_SIZE):
-                    print(f"  Warning: tile {tile_num} has unexpected size {tile.size}, resizing...")
-                    tile = tile.resize((TILE_SIZE, TILE_SIZE), Image.LANCZOS)
+        # Paste tile into output image
+        output_image.paste(tile, (x_offset, y_offset))
+
+        # Progress indicator
+        if (tiles_processed + tiles_missing) % 50 == 0:
+            print(f"  Processed {tiles_processed + tiles_missing}/{GRID_SIZE * GRID_SIZE} tiles...")
+
+    print()
+    print(f"Assembly complete!")
+    print(f"  Tiles processed: {tiles_processed}")
+    print(f"  Missing/placeholder tiles: {tiles_missing}")
+    print(f"  Total tiles: {tiles_processed + tiles_missing}/{GRID_SIZE * GRID_SIZE}")
+    print()
+
+    # Save the output image
+    print(f"Saving to {output_file}...")
+    output_image.save(output_file, "PNG", optimize=False)
+
+    # Get file size
+    file_size_mb = os.path.getsize(output_file) / (1024 * 1024)
+    print(f"Saved! File size: {file_size_mb:.2f} MB")
+    print()
+    print(f"Output: {output_file}")
+    print(f"Dimensions: {output_image.size[0]}x{output_image.size[1]} pixels")
+
+class PNGStripWriter:
+    """Write an RGB PNG incrementally, strip by strip (no full image in memory)
+
+    Every scanline is 'Up' filtered (difference to the previous scanline) and
+    deflated into IDAT chunks as soon as a strip is written.
+    """
+
+    def __init__(self, filename, width, height, zlevel=6, rows=64):
+        import numpy
+        self.numpy = numpy
+        self.width = width
+        self.height = height
+        self.rows = rows  # Scanlines filtered at once
+        self.written = 0
+        self.previous = numpy.zeros((1, width * 3), numpy.uint8)
+        self.compressor = zlib.compressobj(zlevel)
+        self.file = open(filename, "wb")
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        self.chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def chunk(self, tag, data):
+        """Write one PNG chunk"""
+        self.file.write(struct.pack(">I", len(data)) + tag + data +
+                        struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+    def write(self, strip):
+        """Append the scanlines of an RGB image of the full width"""
+        numpy = self.numpy
+        if strip.size[0] != self.width or self.written + strip.size[1] > self.height:
+            raise ValueError(f"strip of size {strip.size} does not fit the {self.width}x{self.height} image")
+        for y in range(0, strip.size[1], self.rows):
+            lines = strip.crop((0, y, self.width, min(y + self.rows, strip.size[1])))
+            data = numpy.asarray(lines).reshape(lines.size[1], self.width * 3)
+            filtered = numpy.empty((data.shape[0], data.shape[1] + 1), numpy.uint8)
+            filtered[:, 0] = 2  # Filter type 'Up'
+            filtered[:1, 1:] = data[:1] - self.previous
+            filtered[1:, 1:] = data[1:] - data[:-1]
+            self.previous = data[-1:].copy()
+            compressed = self.compressor.compress(filtered.tobytes())
+            if compressed:
+                self.chunk(b"IDAT", compressed)
+        self.written += strip.size[1]
+
+    def close(self):
+        """Flush the compressor and finish the file"""
+        if self.written != self.height:
+            raise ValueError(f"only {self.written} of {self.height} rows written")
+        self.chunk(b"IDAT", self.compressor.flush())
+        self.chunk(b"IEND", b"")
+        self.file.close()
+
+def assemble_strips(output_file=OUTPUT_FILE, workers=1):
+    """Assemble the map one row of tiles at a time into a streamed PNG (bounded memory)"""
+    print(f"Assembling {GRID_SIZE}x{GRID_SIZE} map from {TILE_DIR}/ in strips of {OUTPUT_SIZE}x{TILE_SIZE}")
+    print(f"Output size: {OUTPUT_SIZE}x{OUTPUT_SIZE} pixels")
+    print(f"Missing tiles: {MISSING_TILES}")
+    print()
+
+    writer = PNGStripWriter(output_file, OUTPUT_SIZE, OUTPUT_SIZE)
+    strip = Image.new('RGB', (OUTPUT_SIZE, TILE_SIZE), color='black')
+
+    tiles_processed = 0
+    tiles_missing = 0
+
+    # Row by row, every strip is written before the next one is loaded
+    for strip_row in range(GRID_SIZE):
+        for col, row, tile, found in load_tiles(workers, rows=[strip_row]):
+            if found:
                 tiles_processed += 1
             else:
-                print(f"  Warning: tile {tile_num} not found at {tile_path} - using black placeholder")
-                tile = create_blank_tile()
                 tiles_missing += 1
 
-            # Paste tile into output image
-            output_image.paste(tile, (x_offset, y_offset))
+            # Paste tile into the strip
+            strip.paste(tile, (col * TILE_SIZE, 0))
 
             # Progress indicator
             if (tiles_processed + tiles_missing) % 50 == 0:
                 print(f"  Processed {tiles_processed + tiles_missing}/{GRID_SIZE * GRID_SIZE} tiles...")
 
-            tile_num += 1
+        writer.write(strip)
+    writer.close()
 
     print()
     print(f"Assembly complete!")
@@ -87,18 +247,223 @@ def assemble_map():
     print(f"  Total tiles: {tiles_processed + tiles_missing}/{GRID_SIZE * GRID_SIZE}")
     print()
 
-    # Save the output image
-    print(f"Saving to {OUTPUT_FILE}...")
-    output_image.save(OUTPUT_FILE, "PNG", optimize=False)
+    file_size_mb = os.path.getsize(output_file) / (1024 * 1024)
+    print(f"Saved {output_file}! File size: {file_size_mb:.2f} MB")
+    print()
+    print(f"Output: {output_file}")
+    print(f"Dimensions: {OUTPUT_SIZE}x{OUTPUT_SIZE} pixels")
 
-    # Get file size
-    file_size_mb = os.path.getsize(OUTPUT_FILE) / (1024 * 1024)
+def assemble_gtiff(output_file, compress, workers=1):
+    """Write the tiles into a tiled, compressed GeoTIFF with internal overviews (needs GDAL)"""
+    try:
+        from osgeo import gdal
+    except ImportError:
+        print("Error: the GeoTIFF output needs GDAL (python3-gdal), use --output-format png or vrt")
+        sys.exit(1)
+    gdal.UseExceptions()
+
+    print(f"Assembling {GRID_SIZE}x{GRID_SIZE} map from {TILE_DIR}/ into a tiled GeoTIFF")
+    print(f"Output size: {OUTPUT_SIZE}x{OUTPUT_SIZE} pixels, {compress.upper()} compression")
+    print(f"Missing tiles: {MISSING_TILES}")
+    print()
+
+    options = ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "BIGTIFF=IF_SAFER",
+               f"COMPRESS={compress.upper()}"]
+    if compress == "jpeg":
+        options += ["PHOTOMETRIC=YCBCR", "JPEG_QUALITY=90"]
+    else:
+        options += ["PREDICTOR=2"]
+    dataset = gdal.GetDriverByName("GTiff").Create(output_file, OUTPUT_SIZE, OUTPUT_SIZE, 3,
+                                                    gdal.GDT_Byte, options)
+
+    tiles_processed = 0
+    tiles_missing = 0
+
+    # Every tile is written straight into the file in the order it is decoded
+    for col, row, tile, found in load_tiles(workers):
+        if found:
+            tiles_processed += 1
+        else:
+            tiles_missing += 1
+
+        dataset.WriteRaster(col * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE,
+                            tile.convert("RGB").tobytes(), band_list=[1, 2, 3],
+                            buf_pixel_space=3, buf_line_space=3 * TILE_SIZE, buf_band_space=1)
+
+        # Progress indicator
+        if (tiles_processed + tiles_missing) % 50 == 0:
+            print(f"  Processed {tiles_processed + tiles_missing}/{GRID_SIZE * GRID_SIZE} tiles...")
+
+    print()
+    print(f"Assembly complete!")
+    print(f"  Tiles processed: {tiles_processed}")
+    print(f"  Missing/placeholder tiles: {tiles_missing}")
+    print(f"  Total tiles: {tiles_processed + tiles_missing}/{GRID_SIZE * GRID_SIZE}")
+    print()
+
+    # Internal overviews down to about one 256px block
+    levels = []
+    while OUTPUT_SIZE // (2 ** (len(levels) + 1)) >= 256:
+        levels.append(2 ** (len(levels) + 1))
+    print(f"Building overviews {levels}...")
+    gdal.SetConfigOption("COMPRESS_OVERVIEW", compress.upper())
+    if compress == "jpeg":
+        gdal.SetConfigOption("PHOTOMETRIC_OVERVIEW", "YCBCR")
+    dataset.BuildOverviews("AVERAGE", levels)
+    dataset = None
+
+    file_size_mb = os.path.getsize(output_file) / (1024 * 1024)
     print(f"Saved! File size: {file_size_mb:.2f} MB")
     print()
-    print(f"Output: {OUTPUT_FILE}")
-    print(f"Dimensions: {output_image.size[0]}x{output_image.size[1]} pixels")
+    print(f"Output: {output_file}")
+    print(f"Dimensions: {OUTPUT_SIZE}x{OUTPUT_SIZE} pixels")
+
+def write_vrt(output_file):
+    """Write a GDAL VRT mosaic referencing the original tiles (missing tiles stay black)"""
+    print(f"Writing VRT mosaic of the {GRID_SIZE}x{GRID_SIZE} tiles in {TILE_DIR}/")
+    print(f"Missing tiles: {MISSING_TILES}")
+    print()
+
+    tile_dir = os.path.relpath(TILE_DIR, os.path.dirname(os.path.abspath(output_file)))
+    sources = [[] for band in range(3)]
+    tile_num = START_TILE
+    tiles_processed = 0
+    tiles_missing = 0
+
+    # Column-by-column, top-to-bottom layout
+    for col in range(GRID_SIZE):
+        for row in range(GRID_SIZE):
+            tile_path = os.path.join(TILE_DIR, f"{tile_num}.jpg")
+            if tile_num in MISSING_TILES:
+                print(f"  Missing tile {tile_num} at column {col+1}, row {row+1} - left black")
+                tiles_missing += 1
+            elif not os.path.exists(tile_path):
+                print(f"  Warning: tile {tile_num} not found at {tile_path} - left black")
+                tiles_missing += 1
+            else:
+                # Only the header is read, the VRT resamples tiles of unexpected size
+                width, height = Image.open(tile_path).size
+                if (width, height) != (TILE_SIZE, TILE_SIZE):
+                    print(f"  Warning: tile {tile_num} has unexpected size {(width, height)}, resampled by the VRT")
+                for band in range(3):
+                    sources[band].append(f"""    <SimpleSource>
+      <SourceFilename relativeToVRT="1">{tile_dir}/{tile_num}.jpg</SourceFilename>
+      <SourceBand>{band + 1}</SourceBand>
+      <SrcRect xOff="0" yOff="0" xSize="{width}" ySize="{height}"/>
+      <DstRect xOff="{col * TILE_SIZE}" yOff="{row * TILE_SIZE}" xSize="{TILE_SIZE}" ySize="{TILE_SIZE}"/>
+    </SimpleSource>
+""")
+                tiles_processed += 1
+            tile_num += 1
+
+    colors = ["Red", "Green", "Blue"]
+    with open(output_file, "w") as f:
+        f.write(f'<VRTDataset rasterXSize="{OUTPUT_SIZE}" rasterYSize="{OUTPUT_SIZE}">\n')
+        for band in range(3):
+            f.write(f'  <VRTRasterBand dataType="Byte" band="{band + 1}">\n')
+            f.write(f'    <ColorInterp>{colors[band]}</ColorInterp>\n')
+            f.write("".join(sources[band]))
+            f.write('  </VRTRasterBand>\n')
+        f.write('</VRTDataset>\n')
+
+    print(f"  Tiles referenced: {tiles_processed}")
+    print(f"  Missing tiles: {tiles_missing}")
+    print(f"  Total tiles: {tiles_processed + tiles_missing}/{GRID_SIZE * GRID_SIZE}")
+    print()
+    print(f"Output: {output_file} (keep {TILE_DIR}/ next to it)")
+    print(f"Dimensions: {OUTPUT_SIZE}x{OUTPUT_SIZE} pixels")
+
+def slice_tiles(args):
+    """Fast path: cut the original tiles straight into Leaflet tiles, no intermediate map image"""
+    import numpy
+    from raster2tiles import Raster2Tiles
+
+    # The tile geometry of gdal2tiles.py -p raster -l for the assembled map
+    engine = Raster2Tiles(["-l", "-z", args.zoom, "-r", args.resampling,
+                           "--raster-size", f"{OUTPUT_SIZE}x{OUTPUT_SIZE}",
+                           "--processes", str(args.processes),
+                           "--format", args.format,
+                           "--quality", str(args.quality), args.tiles])
+    engine.open_input()
+    tz = engine.tmaxz
+    tsize = engine.tsize[tz]  # Map pixels per tile of the max zoom level
+    if TILE_SIZE % tsize:
+        print(f"Error: zoom {tz} tiles ({tsize} map pixels) do not divide the {TILE_SIZE}px original tiles")
+        sys.exit(1)
+    per_tile = TILE_SIZE // tsize
+    scale = engine.tilesize // tsize  # Nearest neighbour upscaling above the native zoom
+
+    print(f"Slicing {GRID_SIZE}x{GRID_SIZE} original tiles from {TILE_DIR}/ into zoom {tz} tiles in {args.tiles}/")
+    print(f"  {per_tile}x{per_tile} tiles per original tile, native zoom {engine.nativezoom}")
+    print(f"Missing tiles: {MISSING_TILES}")
+    print()
+
+    tiles_processed = 0
+    tiles_missing = 0
+    tile = numpy.empty((engine.tilesize, engine.tilesize, 4), numpy.uint8)
+    tile[:, :, 3] = 255
+
+    for col, row, original, found in load_tiles(args.workers):
+        if found:
+            tiles_processed += 1
+        else:
+            tiles_missing += 1
+
+        data = numpy.asarray(original.convert("RGB"))
+        for j in range(per_tile):
+            for i in range(per_tile):
+                block = data[j * tsize:(j + 1) * tsize, i * tsize:(i + 1) * tsize]
+                tile[:, :, :3] = block.repeat(scale, axis=0).repeat(scale, axis=1)
+                tx = col * per_tile + i
+                ty = row * per_tile + j
+                engine.write_tile(tile, engine.tile_filename(tx, ty, tz), tz)
+
+        # Progress indicator
+        if (tiles_processed + tiles_missing) % 50 == 0:
+            print(f"  Processed {tiles_processed + tiles_missing}/{GRID_SIZE * GRID_SIZE} tiles...")
+
+    print()
+    print(f"Slicing complete!")
+    print(f"  Tiles processed: {tiles_processed}")
+    print(f"  Missing/placeholder tiles: {tiles_missing}")
+    print(f"  Total tiles: {tiles_processed + tiles_missing}/{GRID_SIZE * GRID_SIZE}")
+    print()
+
+    # Overview tiles (zoom levels below the max zoom) from the sliced tiles
+    engine.process()
+    print()
+    print(f"Output: {args.tiles}/{{z}}/{{x}}/{{y}}")
+
+def parse_arguments():
+    """Command line options"""
+    parser = argparse.ArgumentParser(description=f"Assemble the original {GRID_SIZE}x{GRID_SIZE} map tiles from {TILE_DIR}/")
+    parser.add_argument("--output-format", choices=sorted(OUTPUT_FORMATS), default="png",
+                        help="format of the assembled map: png (default), gtiff (tiled GeoTIFF with overviews, needs GDAL) or vrt (mosaic over the original JPEGs)")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help=f"file name of the assembled map (default: {os.path.splitext(OUTPUT_FILE)[0]}.png/.tif/.vrt)")
+    parser.add_argument("--compress", choices=["deflate", "jpeg", "lzw"], default="deflate",
+                        help="compression of the GeoTIFF (default: deflate)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="write the PNG one row of tiles at a time (about 60 MB of memory instead of 1 GB, needs NumPy)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="threads decoding the original JPEGs (default: number of CPUs, 1 = sequential)")
+    parser.add_argument("--tiles", metavar="DIR",
+                        help=f"fast path: write the Leaflet tiles straight into DIR instead of assembling {OUTPUT_FILE}")
+    parser.add_argument("-z", "--zoom", default="0-9",
+                        help="zoom levels of the tiles (default: 0-9)")
+    parser.add_argument("-r", "--resampling", default="average",
+                        help="resampling of the overview tiles: average, near or antialias (default: average)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="processes rendering the overview tiles (default: 1)")
+    parser.add_argument("--format", default="png",
+                        help="tile format as in gdal2tiles.py --format (default: png)")
+    parser.add_argument("--quality", type=int, default=85,
+                        help="quality of JPEG and WebP tiles (default: 85)")
+    return parser.parse_args()
 
 if __name__ == "__main__":
+    args = parse_arguments()
+
     # Check if tile directory exists
     if not os.path.exists(TILE_DIR):
         print(f"Error: Tile directory '{TILE_DIR}' not found!")
@@ -110,5 +475,18 @@ if __name__ == "__main__":
     print(f"Found {available_tiles} tile files in {TILE_DIR}/")
     print()
 
-    # Assemble the map
-    assemble_map()
+    if args.tiles:
+        # Cut the tiles directly
+        slice_tiles(args)
+    else:
+        output_file = args.output or os.path.splitext(OUTPUT_FILE)[0] + OUTPUT_FORMATS[args.output_format]
+        if args.output_format == "gtiff":
+            assemble_gtiff(output_file, args.compress, args.workers)
+        elif args.output_format == "vrt":
+            write_vrt(output_file)
+        elif args.streaming:
+            # Assemble the map strip by strip
+            assemble_strips(output_file, args.workers)
+        else:
+            # Assemble the map
+            assemble_map(output_file, args.workers)
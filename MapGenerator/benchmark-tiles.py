@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Benchmark the tile pipeline on synthetic maps
+Measures the three phases of the map generation without the proprietary map:
+
+- assemble: assemble-original-map.py stitches a grid of synthetic 1024x1024
+            JPEG "original tiles" into the source PNG
+- base:     the tiler writes the tiles of the max zoom level
+- overview: the tiler builds the lower zoom levels from the base tiles
+            (gdal2tiles.py --resume / raster2tiles.py --raster-size)
+
+Every phase runs in its own subprocess and is measured for wall time, peak
+RSS (of the largest process, not the sum of the workers), tiles per second
+and tiles/bytes per zoom level, for every map size, engine and resampling.
+The synthetic tiles are seeded, so runs on the same sizes are comparable:
+
+    python3 benchmark-tiles.py run --sizes 2048,8192 -o before.json
+    ... change gdal2tiles.py ...
+    python3 benchmark-tiles.py run --sizes 2048,8192 -o after.json
+    python3 benchmark-tiles.py compare before.json after.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import platform
+import importlib.util
+import subprocess
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TILE_SIZE = 1024  # Size of the original tiles (see assemble-original-map.py)
+START_TILE = 75879
+ENGINES = {"gdal": "gdal2tiles.py", "numpy": "raster2tiles.py"}
+RESAMPLINGS = {"gdal": ["average", "near", "bilinear", "cubic", "cubicspline", "lanczos", "antialias"],
+               "numpy": ["average", "near", "antialias"]}
+
+# Runs assemble-original-map.py with a grid of the benchmark size instead of 18x18
+ASSEMBLE_CODE = """
+import importlib.util, sys
+spec = importlib.util.spec_from_file_location("assembler", sys.argv[1])
+assembler = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(assembler)
+grid = int(sys.argv[2])
+assembler.GRID_SIZE = grid
+assembler.OUTPUT_SIZE = grid * assembler.TILE_SIZE
+assembler.END_TILE = assembler.START_TILE + grid * grid - 1
+assembler.MISSING_TILES = []
+sys.argv = sys.argv[:1] + sys.argv[3:]
+args = assembler.parse_arguments()
+if args.streaming:
+    assembler.assemble_strips(args.output, args.workers)
+else:
+    assembler.assemble_map(args.output, args.workers)
+"""
+
+# Runs a phase and writes its peak RSS (KB) to a file. The RSS high-water mark of
+# a forked process starts at the one of its parent, so the phases are started
+# by this small interpreter and not by the benchmark holding NumPy arrays
+MEASURE_CODE = """
+import resource, subprocess, sys
+status = subprocess.call(sys.argv[2:])
+with open(sys.argv[1], "w") as f:
+    f.write(str(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+sys.exit(status)
+"""
+
+def synthesize_tiles(directory, grid, seed):
+    """Write a grid of synthetic original tiles: smooth terrain with seeded noise"""
+    import numpy
+    from PIL import Image
+
+    os.makedirs(directory, exist_ok=True)
+    y, x = numpy.mgrid[0:TILE_SIZE, 0:TILE_SIZE].astype(numpy.float32) / TILE_SIZE
+    for col in range(grid):
+        for row in range(grid):
+            tile_num = START_TILE + col * grid + row
+            tile_path = os.path.join(directory, f"{tile_num}.jpg")
+            if os.path.exists(tile_path):
+                continue
+            rng = numpy.random.default_rng(seed + tile_num)
+            gx, gy = (col + x) / grid, (row + y) / grid  # Position on the whole map
+            height = (numpy.sin(gx * 23.0) * numpy.cos(gy * 17.0) + numpy.sin((gx + gy) * 61.0) * 0.3) * 0.5 + 0.5
+            rgb = numpy.stack([height * 120 + 60, height * 90 + 90, 200 - height * 140], axis=-1)
+            rgb += rng.normal(0, 8, rgb.shape)
+            image = Image.fromarray(numpy.clip(rgb, 0, 255).astype(numpy.uint8), "RGB")
+            image.save(tile_path, "JPEG", quality=90)
+
+def count_tiles(output, zooms):
+    """Tiles and bytes of the zoom levels in the output directory, {zoom: {"tiles", "bytes"}}"""
+    stats = {}
+    for z in zooms:
+        tiles = size = 0
+        for root, dirs, files in os.walk(os.path.join(output, str(z))):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                tiles += 1
+                size += os.path.getsize(os.path.join(root, name))
+        stats[str(z)] = {"tiles": tiles, "bytes": size}
+    return stats
+
+def run_phase(command, log_file, cwd=None):
+    """Run a phase in a subprocess, returns its wall time (s) and peak RSS (MB)"""
+    rss_file = log_file + ".rss"
+    with open(log_file, "w") as log:
+        log.write(" ".join(command) + "\n\n")
+        log.flush()
+        start = time.perf_counter()
+        returncode = subprocess.call([sys.executable, "-c", MEASURE_CODE, rss_file] + command,
+                                     stdout=log, stderr=subprocess.STDOUT, cwd=cwd)
+        wall = time.perf_counter() - start
+    if returncode != 0:
+        with open(log_file) as log:
+            print(log.read()[-2000:])
+        print(f"Error: the phase failed with exit code {returncode}, see {log_file}")
+        sys.exit(1)
+    with open(rss_file) as f:
+        rss = int(f.read()) / 1024.0
+    os.unlink(rss_file)
+    return wall, rss
+
+def make_result(size, engine, resampling, phase, wall, rss, zooms, tiles=None, output_bytes=None):
+    """One benchmark record"""
+    if tiles is None:
+        tiles = sum(z["tiles"] for z in zooms.values())
+    if output_bytes is None:
+        output_bytes = sum(z["bytes"] for z in zooms.values())
+    return {"size": size, "engine": engine, "resampling": resampling, "phase": phase,
+            "wall_s": round(wall, 3), "peak_rss_mb": round(rss, 1),
+            "tiles": tiles, "tiles_per_s": round(tiles / wall, 1) if wall else None,
+            "bytes": output_bytes, "zooms": zooms}
+
+def print_result(result):
+    """One line of the result table"""
+    print(f"  {result['phase']:<9} {result['engine'] or '-':<6} {result['resampling'] or '-':<12}"
+          f" {result['wall_s']:>8.2f} s {result['tiles_per_s'] or 0:>9.1f} tiles/s"
+          f" {result['peak_rss_mb']:>8.1f} MB RSS {result['bytes'] / (1024 * 1024):>8.2f} MB out")
+
+def benchmark(args):
+    """Run all the phases for all the sizes, engines and resamplings"""
+    sizes = [int(s) for s in args.sizes.split(",")]
+    for size in sizes:
+        if size % TILE_SIZE:
+            print(f"Error: the map size {size} is not a multiple of the {TILE_SIZE}px original tiles")
+            sys.exit(1)
+    engines = args.engines.split(",") if args.engines else \
+        [e for e in ENGINES if e != "gdal" or importlib.util.find_spec("osgeo")]
+    for engine in engines:
+        if engine not in ENGINES:
+            print(f"Error: unknown engine '{engine}', use {', '.join(ENGINES)}")
+            sys.exit(1)
+
+    results = []
+    for size in sizes:
+        grid = size // TILE_SIZE
+        workdir = os.path.join(os.path.abspath(args.workdir), str(size))
+        os.makedirs(workdir, exist_ok=True)
+        print(f"Map {size}x{size} ({grid}x{grid} original tiles) in {workdir}/")
+        synthesize_tiles(os.path.join(workdir, "original-map"), grid, args.seed)
+
+        # Phase 1: assemble the source map
+        source = os.path.join(workdir, "source-map.png")
+        command = [sys.executable, "-c", ASSEMBLE_CODE, os.path.join(SCRIPT_DIR, "assemble-original-map.py"),
+                   str(grid), "-o", source, "--workers", str(args.workers)]
+        if args.streaming:
+            command.append("--streaming")
+        wall, rss = run_phase(command, os.path.join(workdir, "assemble.log"), cwd=workdir)
+        result = make_result(size, None, None, "assemble", wall, rss, {},
+                             tiles=grid * grid, output_bytes=os.path.getsize(source))
+        print_result(result)
+        results.append(result)
+
+        # Same zoom levels as generate-tiles.sh (0-9 for the 18432px map with native zoom 7)
+        nativezoom = int(math.ceil(math.log2(size / 256.0)))
+        maxzoom = nativezoom + args.extra_zooms
+        for engine in engines:
+            script = os.path.join(SCRIPT_DIR, ENGINES[engine])
+            for resampling in args.resampling.split(",") if args.resampling else RESAMPLINGS[engine]:
+                if resampling not in RESAMPLINGS[engine]:
+                    print(f"  Skipping resampling '{resampling}', not supported by {ENGINES[engine]}")
+                    continue
+                output = os.path.join(workdir, f"tiles-{engine}-{resampling}")
+                shutil.rmtree(output, ignore_errors=True)
+                common = [sys.executable, script, "-l", "-p", "raster", "-w", "none", "-r", resampling,
+                          "--processes", str(args.processes), "--format", args.format]
+
+                # Phase 2: base tiles (max zoom only)
+                wall, rss = run_phase(common + ["-z", str(maxzoom), source, output],
+                                      os.path.join(workdir, f"base-{engine}-{resampling}.log"))
+                result = make_result(size, engine, resampling, "base", wall, rss,
+                                     count_tiles(output, [maxzoom]))
+                print_result(result)
+                results.append(result)
+
+                # Phase 3: overview tiles from the base tiles
+                if engine == "gdal":
+                    command = common + ["-z", f"0-{maxzoom}", "--resume", source, output]
+                else:
+                    command = common + ["-z", f"0-{maxzoom}", "--raster-size", f"{size}x{size}", output]
+                wall, rss = run_phase(command, os.path.join(workdir, f"overview-{engine}-{resampling}.log"))
+                result = make_result(size, engine, resampling, "overview", wall, rss,
+                                     count_tiles(output, range(maxzoom)))
+                print_result(result)
+                results.append(result)
+
+                if not args.keep:
+                    shutil.rmtree(output, ignore_errors=True)
+        print()
+
+    report = {"meta": machine_info(args), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results: {args.output}")
+
+def machine_info(args):
+    """What the results depend on besides the code"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit,
+            "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "processes": args.processes, "workers": args.workers,
+            "format": args.format, "seed": args.seed, "extra_zooms": args.extra_zooms,
+            "streaming": args.streaming}
+
+def compare(args):
+    """Compare the results of two runs, matched by size, engine, resampling and phase"""
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    key = lambda r: (r["size"], r["engine"] or "-", r["resampling"] or "-", r["phase"])
+    before = {key(r): r for r in base["results"]}
+
+    print(f"Base: {args.base} ({base['meta'].get('commit')}, {base['meta'].get('date')})")
+    print(f"New:  {args.new} ({new['meta'].get('commit')}, {new['meta'].get('date')})")
+    print()
+    print(f"  {'size':>6} {'phase':<9} {'engine':<6} {'resampling':<12} {'wall base':>10} {'wall new':>10} {'change':>8} {'RSS MB':>15} {'bytes':>8}")
+    for r in new["results"]:
+        b = before.get(key(r))
+        if b is None:
+            print(f"  {r['size']:>6} {r['phase']:<9} {key(r)[1]:<6} {key(r)[2]:<12} {'-':>10} {r['wall_s']:>9.2f}s  (new)")
+            continue
+        change = (r["wall_s"] - b["wall_s"]) / b["wall_s"] * 100 if b["wall_s"] else 0.0
+        bytes_change = (r["bytes"] - b["bytes"]) / b["bytes"] * 100 if b["bytes"] else 0.0
+        verdict = ""
+        if change <= -args.threshold:
+            verdict = "faster"
+        elif change >= args.threshold:
+            verdict = "SLOWER"
+        print(f"  {r['size']:>6} {r['phase']:<9} {key(r)[1]:<6} {key(r)[2]:<12} {b['wall_s']:>9.2f}s {r['wall_s']:>9.2f}s"
+              f" {change:>+7.1f}% {b['peak_rss_mb']:>7.0f}>{r['peak_rss_mb']:<7.0f} {bytes_change:>+7.1f}% {verdict}")
+
+def parse_arguments():
+    """Command line options"""
+    parser = argparse.ArgumentParser(description="Benchmark the tile pipeline on synthetic maps")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmark and write the results as JSON")
+    run.add_argument("--sizes", default="2048,8192",
+                     help="map sizes, multiples of 1024 (default: 2048,8192; the real map is 18432)")
+    run.add_argument("--engines",
+                     help=f"tile engines: {', '.join(ENGINES)} (default: all available)")
+    run.add_argument("-r", "--resampling",
+                     help="resampling modes (default: all of the engine)")
+    run.add_argument("--extra-zooms", type=int, default=2,
+                     help="zoom levels above the native zoom (default: 2, as 0-9 for the real map)")
+    run.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                     help="rendering processes of the tilers (default: number of CPUs)")
+    run.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                     help="JPEG decoding threads of the assembler (default: number of CPUs)")
+    run.add_argument("--streaming", action="store_true",
+                     help="assemble with --streaming")
+    run.add_argument("--format", default="png",
+                     help="tile format (default: png)")
+    run.add_argument("--seed", type=int, default=1,
+                     help="seed of the synthetic tiles (default: 1)")
+    run.add_argument("--workdir", default="benchmark",
+                     help="directory of the synthetic maps and tiles (default: benchmark)")
+    run.add_argument("--keep", action="store_true",
+                     help="keep the generated tiles")
+    run.add_argument("-o", "--output", default="benchmark.json",
+                     help="JSON results (default: benchmark.json)")
+
+    comp = commands.add_parser("compare", help="compare two JSON results")
+    comp.add_argument("base", help="results of the baseline run")
+    comp.add_argument("new", help="results of the new run")
+    comp.add_argument("--threshold", type=float, default=5.0,
+                      help="wall time change in percent reported as faster/slower (default: 5)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.command == "compare":
+        compare(args)
+    else:
+        benchmark(args)
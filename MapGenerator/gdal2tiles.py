@@ -50,6 +50,19 @@ except:
 
 import os
 import math
+import time
+import json
+import stat
+import shutil
+import collections
+import zlib
+import struct
+import hashlib
+import signal
+import sqlite3
+import queue
+import threading
+import multiprocessing
 
 try:
     from PIL import Image
@@ -75,6 +88,54 @@ resampling_list = (
 profile_list = ('mercator', 'geodetic', 'raster')  # ,'zoomify')
 webviewer_list = ('all', 'google', 'openlayers', 'none')
 
+# Tile formats: GDAL driver, file extension and creation options ('%d' is the quality)
+
+format_list = ('png', 'jpeg', 'webp', 'webp-lossless')
+format_drivers = {
+    'png': ('PNG', 'png', []),
+    'jpeg': ('JPEG', 'jpg', ['QUALITY=%d']),
+    'webp': ('WEBP', 'webp', ['QUALITY=%d']),
+    'webp-lossless': ('WEBP', 'webp', ['LOSSLESS=YES']),
+    }
+
+# Traversal orders of the tiles of a zoom level: row by row, Z-order curve
+# (Morton) and Hilbert curve; the curves keep neighbouring tiles close in time
+
+traversal_list = ('row', 'morton', 'hilbert')
+
+
+def morton_key(x, y):
+    """Position of (x, y) on the Z-order curve (interleaved bits)"""
+
+    key = 0
+    bit = 0
+    while x >> bit or y >> bit:
+        key |= (x >> bit & 1) << 2 * bit | (y >> bit & 1) << 2 * bit \
+            + 1
+        bit += 1
+    return key
+
+
+def hilbert_key(n, x, y):
+    """Position of (x, y) on the Hilbert curve filling the n x n square (n a power of 2)"""
+
+    key = 0
+    s = n // 2
+    while s > 0:
+        rx = int(x & s > 0)
+        ry = int(y & s > 0)
+        key += s * s * (3 * rx ^ ry)
+
+        # Rotate the quadrant
+
+        if ry == 0:
+            if rx == 1:
+                (x, y) = (n - 1 - x, n - 1 - y)
+            (x, y) = (y, x)
+        s //= 2
+    return key
+
+
 # =============================================================================
 # =============================================================================
 # =============================================================================
@@ -582,6 +643,474 @@ class Zoomify(object):
                             self.tileformat))
 
 
+# ---------------------
+
+class PNGEncoder(object):
+
+    """
+    PNG encoder of the tile arrays
+    ------------------------------
+
+    Writes 8-bit grayscale, RGB, RGBA or palette PNG files from numpy arrays
+    (height, width, bands) with the chosen zlib level and strategy and the
+    chosen scanline filter. The 'adaptive' filter picks the filter of every
+    row by the minimal sum of absolute differences, as libpng does.
+
+    With quantize the tile is reduced to an adaptive palette of at most 256
+    colors (the fast octree of PIL), but only when the RMSE to the original
+    pixels does not exceed the threshold. With optimize all filters and
+    strategies are tried at zlib level 9 and the smallest result is kept;
+    an opaque alpha band is dropped.
+    """
+
+    filters = ('none', 'sub', 'up', 'average', 'paeth', 'adaptive')
+    strategies = {
+        'default': zlib.Z_DEFAULT_STRATEGY,
+        'filtered': zlib.Z_FILTERED,
+        'huffman': zlib.Z_HUFFMAN_ONLY,
+        'rle': zlib.Z_RLE,
+        }
+    colortypes = {
+        1: 0,
+        2: 4,
+        3: 2,
+        4: 6,
+        }
+
+    def __init__(
+        self,
+        zlevel=6,
+        filter='adaptive',
+        strategy='default',
+        quantize=None,
+        optimize=False,
+        ):
+        """Encoder settings, the defaults give the same compression as GDAL"""
+
+        self.zlevel = zlevel
+        self.filter = filter
+        self.strategy = strategy
+        self.quantize = quantize
+        self.optimize = optimize
+
+    def encode(self, array):
+        """Returns the PNG file content of the array and whether it was quantized"""
+
+        (height, width, bands) = array.shape
+        if self.optimize and bands in (2, 4) and array[:, :, -1].min() \
+            == 255:
+            array = array[:, :, :-1]
+            bands -= 1
+
+        palette = None
+        if self.quantize is not None and bands in (3, 4):
+            (indices, palette) = self.quantize_array(array)
+        if palette is not None:
+            image = indices.reshape(height, width, 1)
+            colortype = 3
+        else:
+            image = array
+            colortype = self.colortypes[bands]
+
+        if self.optimize:
+            trials = [(f, st, 9) for f in self.filters for st in
+                      self.strategies]
+        else:
+            trials = [(self.filter, self.strategy, self.zlevel)]
+        idat = None
+        for (f, st, level) in trials:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9,
+                    self.strategies[st])
+            data = compressor.compress(self.filter_rows(image, f)) \
+                + compressor.flush()
+            if idat is None or len(data) < len(idat):
+                idat = data
+
+        png = [b'\x89PNG\r\n\x1a\n', self.chunk(b'IHDR', struct.pack('>IIBBBBB'
+               , width, height, 8, colortype, 0, 0, 0))]
+        if palette is not None:
+            png.append(self.chunk(b'PLTE', palette[:, :3].tobytes()))
+            if palette.shape[1] == 4:
+                alpha = palette[:, 3].tobytes().rstrip(b'\xff')
+                if alpha:
+                    png.append(self.chunk(b'tRNS', alpha))
+        png.append(self.chunk(b'IDAT', idat))
+        png.append(self.chunk(b'IEND', b''))
+        return (b''.join(png), palette is not None)
+
+    def quantize_array(self, array):
+        """Returns the palette indices and the palette (colors, bands) of the array,
+        or (None, None) if the quantization error is over the threshold"""
+
+        bands = array.shape[2]
+        mode = ('RGB', 'RGBA')[bands - 3]
+        im = Image.fromarray(numpy.ascontiguousarray(array), mode)
+        q = im.quantize(colors=256, method=getattr(Image, 'Quantize',
+                        Image).FASTOCTREE)
+        indices = numpy.asarray(q)
+        quantized = numpy.asarray(q.convert(mode))
+        rmse = math.sqrt(numpy.mean((quantized.astype(numpy.float32)
+                         - array) ** 2))
+        if rmse > self.quantize:
+            return (None, None)
+        palette = numpy.zeros((int(indices.max()) + 1, bands),
+                              numpy.uint8)
+        palette[indices.ravel()] = quantized.reshape(-1, bands)
+        return (indices, palette)
+
+    def filter_rows(self, image, f):
+        """Returns the filtered scanlines of the image, each with its filter type byte"""
+
+        (height, width, bpp) = image.shape
+        x = image.reshape(height, width * bpp).astype(numpy.int16)
+        zeros = numpy.zeros((height, bpp), numpy.int16)
+        up = numpy.vstack((numpy.zeros((1, width * bpp), numpy.int16),
+                          x[:-1]))
+        left = numpy.hstack((zeros, x[:, :-bpp]))
+        upleft = numpy.hstack((zeros, up[:, :-bpp]))
+
+        if f == 'adaptive':
+            candidates = [self.filter_array(x, left, up, upleft, i)
+                          for i in range(5)]
+            scores = [numpy.abs(c.astype(numpy.int8).astype(numpy.int16)).sum(axis=1)
+                      for c in candidates]
+            types = numpy.argmin(numpy.vstack(scores), axis=0)
+            rows = numpy.choose(types[:, None], candidates)
+        else:
+            i = self.filters.index(f)
+            types = numpy.full(height, i)
+            rows = self.filter_array(x, left, up, upleft, i)
+        return numpy.hstack((types[:, None].astype(numpy.uint8),
+                            rows)).tobytes()
+
+    def filter_array(
+        self,
+        x,
+        left,
+        up,
+        upleft,
+        i,
+        ):
+        """Returns the scanlines filtered by the PNG filter type i"""
+
+        if i == 0:
+            r = x
+        elif i == 1:
+            r = x - left
+        elif i == 2:
+            r = x - up
+        elif i == 3:
+            r = x - (left + up) // 2
+        else:
+            p = left + up - upleft
+            pa = numpy.abs(p - left)
+            pb = numpy.abs(p - up)
+            pc = numpy.abs(p - upleft)
+            r = x - numpy.where((pa <= pb) & (pa <= pc), left,
+                                numpy.where(pb <= pc, up, upleft))
+        return (r & 0xff).astype(numpy.uint8)
+
+    def chunk(self, tag, data):
+        """Returns the PNG chunk"""
+
+        return struct.pack('>I', len(data)) + tag + data \
+            + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+# ---------------------
+
+class TileJournal(object):
+
+    """
+    Append-only journal of the completed tiles
+    ------------------------------------------
+
+    Every process appends the tiles it has completed into its own file per
+    zoom level ('<zoom>-<pid>.log' with one 'x y' line per tile). The files
+    are synced to disk in batches, so after a crash at most the last batch
+    of tiles is rendered again. Resume replays the journal instead of
+    testing the existence of every tile file.
+    """
+
+    def __init__(self, path, batchsize=256):
+        """Open the journal directory for appending"""
+
+        self.path = path
+        self.batchsize = batchsize
+        self.files = {}
+        self.pending = 0
+        self.lock = threading.Lock()  # Tiles are added by the writer threads
+        if not os.path.exists(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                pass  # Created by another worker process
+
+    def add(
+        self,
+        tz,
+        tx,
+        ty,
+        ):
+        """Record the tile as completed"""
+
+        with self.lock:
+            if tz not in self.files:
+                self.files[tz] = open(os.path.join(self.path,
+                        '%d-%d.log' % (tz, os.getpid())), 'a')
+            self.files[tz].write('%d %d\n' % (tx, ty))
+            self.pending += 1
+            if self.pending >= self.batchsize:
+                self.sync()
+
+    def flush(self):
+        """Write the recorded tiles to disk"""
+
+        with self.lock:
+            self.sync()
+
+    def sync(self):
+        """Write the recorded tiles to disk (the lock is held)"""
+
+        for f in self.files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending = 0
+
+    def close(self):
+        """Flush and close the journal files"""
+
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def replay(self):
+        """Returns the completed tiles as a dict of sets of (x, y) per zoom level"""
+
+        done = {}
+        for name in os.listdir(self.path):
+            if not name.endswith('.log'):
+                continue
+            tz = int(name.split('-')[0])
+            tiles = done.setdefault(tz, set())
+            f = open(os.path.join(self.path, name))
+            for line in f:
+                xy = line.split()
+
+                # A line cut by a crash is not complete
+
+                if len(xy) == 2 and line.endswith('\n'):
+                    tiles.add((int(xy[0]), int(xy[1])))
+            f.close()
+        return done
+
+
+# ---------------------
+
+class TileWriter(object):
+
+    """
+    Background writer of the rendered tiles
+    ---------------------------------------
+
+    The rendering thread puts every finished tile into a bounded queue and
+    continues with the next tile while the writer threads encode the tile
+    (PNG/JPEG/WebP compression releases the GIL) and write it to disk. The
+    queue holds at most queuesize tiles, so a slow disk blocks the rendering
+    instead of filling the memory. An error of a writer thread is raised in
+    the rendering thread by the next put() or flush().
+    """
+
+    def __init__(
+        self,
+        write,
+        threads,
+        queuesize,
+        ):
+        """Start the writer threads, write(*job) writes one queued tile"""
+
+        self.write = write
+        self.queue = queue.Queue(queuesize)
+        self.exception = None
+        self.threads = []
+        for i in range(threads):
+            t = threading.Thread(target=self.run, name='tilewriter-%d'
+                                 % i)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def run(self):
+        """Writer thread: write the queued tiles until the None sentinel"""
+
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                if self.exception is None:
+                    self.write(*job)
+            except Exception as e:
+                self.exception = e
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        """Raise the error of a writer thread"""
+
+        if self.exception is not None:
+            (e, self.exception) = (self.exception, None)
+            raise e
+
+    def put(self, job):
+        """Queue a tile, blocks while the queue is full"""
+
+        self.check()
+        self.queue.put(job)
+
+    def flush(self):
+        """Wait until all queued tiles are written"""
+
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        """Write the queued tiles and stop the writer threads"""
+
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+        self.check()
+
+
+# ---------------------
+
+class MBTiles(object):
+
+    """
+    MBTiles (SQLite) tile store
+    ---------------------------
+
+    Tiles are stored once per distinct content in the 'images' table and
+    referenced by the 'map' table, the 'tiles' view of the MBTiles 1.3
+    specification joins them. Every process opens its own connection, the
+    database is in WAL mode so that readers never block the single writer,
+    and the tiles are inserted in batched transactions.
+
+    The tile_row is in the TMS scheme (0 at the bottom) as required by the
+    specification, so the rows of the --leaflet tiles are flipped.
+    """
+
+    def __init__(
+        self,
+        filename,
+        leaflet,
+        batchsize=1000,
+        ):
+        """Open (and create) the MBTiles database"""
+
+        self.leaflet = leaflet
+        self.batchsize = batchsize
+        self.pending = 0
+        self.db = sqlite3.connect(filename, timeout=60)
+        self.db.execute('PRAGMA busy_timeout = 60000')
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT);
+            CREATE UNIQUE INDEX IF NOT EXISTS name ON metadata (name);
+            CREATE TABLE IF NOT EXISTS images (tile_data BLOB, tile_id TEXT);
+            CREATE UNIQUE INDEX IF NOT EXISTS images_id ON images (tile_id);
+            CREATE TABLE IF NOT EXISTS map (zoom_level INTEGER, tile_column INTEGER,
+                tile_row INTEGER, tile_id TEXT);
+            CREATE UNIQUE INDEX IF NOT EXISTS map_index ON map
+                (zoom_level, tile_column, tile_row);
+            CREATE VIEW IF NOT EXISTS tiles AS
+                SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+                map.tile_row AS tile_row, images.tile_data AS tile_data
+                FROM map JOIN images ON images.tile_id = map.tile_id;
+            """)
+
+    def row(self, tz, ty):
+        """TMS tile_row of the tile row ty"""
+
+        if self.leaflet:
+            return 2 ** tz - 1 - ty
+        return ty
+
+    def put(
+        self,
+        tz,
+        tx,
+        ty,
+        data,
+        ):
+        """Insert the encoded tile, returns True if its content was not stored yet"""
+
+        digest = hashlib.sha1(data).hexdigest()
+        cur = self.db.execute('INSERT OR IGNORE INTO images (tile_data, tile_id) VALUES (?, ?)'
+                              , (sqlite3.Binary(data), digest))
+        self.db.execute('INSERT OR REPLACE INTO map (zoom_level, tile_column, tile_row, tile_id) VALUES (?, ?, ?, ?)'
+                        , (tz, tx, self.row(tz, ty), digest))
+        self.pending += 1
+        if self.pending >= self.batchsize:
+            self.commit()
+        return cur.rowcount == 1
+
+    def get(
+        self,
+        tz,
+        tx,
+        ty,
+        ):
+        """Returns the encoded tile or None"""
+
+        r = self.db.execute('SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?'
+                            , (tz, tx, self.row(tz, ty))).fetchone()
+        if r is None:
+            return None
+        return bytes(r[0])
+
+    def set_metadata(self, metadata):
+        """Replace the rows of the metadata table"""
+
+        for (name, value) in metadata.items():
+            self.db.execute('INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)'
+                            , (name, str(value)))
+        self.commit()
+
+    def commit(self):
+        """Commit the inserted tiles"""
+
+        self.db.commit()
+        self.pending = 0
+
+    def prune(self):
+        """Delete the images no more referenced by any tile (replaced by --update-region)"""
+
+        self.db.execute('DELETE FROM images WHERE tile_id NOT IN (SELECT tile_id FROM map)'
+                        )
+        self.commit()
+
+    def close(self):
+        """Commit and close the database"""
+
+        self.commit()
+        self.db.close()
+
+    def replay(self):
+        """Returns the stored tiles as a dict of sets of (x, y) per zoom level"""
+
+        done = {}
+        for (tz, tx, row) in self.db.execute('SELECT zoom_level, tile_column, tile_row FROM map'
+                ):
+            done.setdefault(tz, set()).add((tx, self.row(tz, row)))
+        return done
+
+
 # =============================================================================
 # =============================================================================
 # =============================================================================
@@ -593,6 +1122,8 @@ class GDAL2Tiles(object):
     def process(self):
         """The main processing function, runs all the main steps of processing"""
 
+        starttime = time.time()
+
         # Opening and preprocessing of the input file
 
         self.open_input()
@@ -601,13 +1132,63 @@ class GDAL2Tiles(object):
 
         self.generate_metadata()
 
-        # Generation of the lowest tiles
+        # MBTiles output (a new run starts with an empty database)
+
+        if self.options.mbtiles:
+            self.open_mbtiles(clear=not self.options.resume
+                              and not self.updateregion)
+            self.mbtiles_metadata()
+
+        # Journal of the completed tiles (a new run starts with an empty one)
+
+        self.open_journal(clear=not self.options.resume
+                          and not self.updateregion)
+        self.open_writer()
+
+        # SIGTERM (docker stop) and SIGINT (Ctrl+C) stop the rendering cleanly
+
+        signal.signal(signal.SIGTERM, self.signal_stop)
+        signal.signal(signal.SIGINT, self.signal_stop)
+
+        # Pool of worker processes, each with its own handle on the input
 
-        self.generate_base_tiles()
+        if self.options.processes > 1:
+            self.pool = multiprocessing.get_context('spawn').Pool(
+                self.options.processes, worker_init, (self.arguments, ))
 
-        # Generation of the overview tiles (higher in the pyramid)
+        try:
+            if self.options.depthfirst:
+
+                # Generation of all the tiles in one pass over the quadtree
+
+                self.generate_tiles_depth_first()
+            else:
+
+                # Generation of the lowest tiles
+
+                self.generate_base_tiles()
+
+                # Generation of the overview tiles (higher in the pyramid)
+
+                self.generate_overview_tiles()
+        finally:
+            if self.pool:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+            if self.writer:
+                self.writer.close()
+            if self.mbtiles:
+                if self.updateregion and not self.stopped:
+                    self.mbtiles.prune()
+                self.mbtiles.close()
+            self.journal.close()
 
-        self.generate_overview_tiles()
+        if self.stopped:
+            print('Stopped, continue the rendering with --resume')
+        self.print_tilestats()
+        if self.options.statsjson:
+            self.write_stats_json(time.time() - starttime)
 
     # -------------------------------------------------------------------------
 
@@ -637,16 +1218,71 @@ class GDAL2Tiles(object):
 
     # -------------------------------------------------------------------------
 
+    def signal_stop(self, signum, frame):
+        """Signal handler: stop the rendering (and the worker processes), the journal is flushed on exit"""
+
+        self.stop()
+        if self.pool:
+            for p in multiprocessing.active_children():
+                os.kill(p.pid, signal.SIGTERM)
+
+    # -------------------------------------------------------------------------
+
+    def run_parallel(
+        self,
+        worker,
+        jobs,
+        tcount,
+        ti=0,
+        ):
+        """Distribute the tile jobs over the worker pool and merge their progress into one progressbar"""
+
+        for (done, tilestats) in self.pool.imap_unordered(worker, jobs):
+            ti += done
+            self.merge_tilestats(tilestats)
+            if not self.options.verbose:
+                self.progressbar(ti / float(tcount))
+
+            # The stopped worker processes finish the remaining jobs immediately
+
+            if self.stopped:
+                break
+
+        return ti
+
+    # -------------------------------------------------------------------------
+
     def __init__(self, arguments):
         """Constructor function - initialization"""
 
         self.stopped = False
         self.input = None
         self.output = None
-
-        # Tile format
+        self.arguments = arguments
+        self.pool = None
+        self.tcount = None
+        self.ti = 0
+        self.strip = None
+        self.tilestats = {}
+        self.uniform_inodes = {}
+        self.updateregion = None
+        self.updateminmax = None
+        self.journal = None
+        self.journaldone = None
+        self.mbtiles = None
+        self.antialias_array = None
+        self.depthfirst_split = None
+        self.blockcache = None
+        self.mempool = {}
+        self.writer = None
+        self.tiledirs = set()
+        self.countlock = threading.Lock()
+
+        # Tile format (the tile size is set by --tilesize and --retina)
 
         self.tilesize = 256
+        self.gridsize = 256
+        self.tilesuffix = ''
         self.tiledriver = 'PNG'
         self.tileext = 'png'
 
@@ -730,6 +1366,21 @@ gdal_vrtmerge.py -o merged.vrt %s"""
         if self.options.url:
             self.options.url += os.path.basename(self.output) + '/'
 
+        # Tile size: the tiles are laid out on the grid of --tilesize pixels (the
+        # raster pixels of a tile at the native zoom), --retina writes '@2x' tiles
+        # with twice the pixels on the same grid
+
+        size = self.options.tilesize
+        if size < 64 or size > 4096 or size & size - 1:
+            self.error('--tilesize must be a power of two from 64 to 4096.'
+                       )
+        self.gridsize = size
+        self.tilesize = size
+        if self.options.retina:
+            self.tilesize = 2 * size
+            self.tilesuffix = '@2x'
+        self.querysize = 4 * self.tilesize
+
         # Supported options
 
         self.resampling = None
@@ -746,7 +1397,7 @@ gdal_vrtmerge.py -o merged.vrt %s"""
         elif self.options.resampling == 'antialias':
 
             try:
-                if numpy:
+                if numpy and Image:
                     pass
             except:
                 self.error("'antialias' resampling algorithm is not available."
@@ -771,6 +1422,130 @@ gdal_vrtmerge.py -o merged.vrt %s"""
 
             self.resampling = gdal.GRA_Lanczos
 
+        if self.options.stripread:
+            if self.options.profile != 'raster':
+                self.error("--strip-read is available only for the 'raster' profile."
+                           )
+            if self.options.depthfirst:
+                self.error('--strip-read can not be combined with --depth-first.'
+                           , 'The depth-first walk does not visit the base tiles row by row.'
+                           )
+            if self.options.traversal != 'row':
+                self.error('--strip-read needs --traversal row.',
+                           'Only the last strip of tiles is kept in memory.'
+                           )
+            try:
+                if numpy:
+                    pass
+            except:
+                self.error('--strip-read is not available.',
+                           'Install numpy.')
+
+        if self.options.writerthreads < 0:
+            self.error('--writer-threads must be 0 or more.')
+
+        if self.options.traversal != 'row' and self.options.depthfirst:
+            self.error('--traversal can not be combined with --depth-first.'
+                       , 'The depth-first walk has its own (quadtree) order.')
+
+        # Encoding stage of the PNG tiles
+
+        self.pngencoder = None
+        if self.options.pngquantize is not None \
+            or self.options.pngzlevel is not None \
+            or self.options.pngfilter or self.options.pngoptimize:
+            try:
+                if numpy and Image:
+                    pass
+            except:
+                self.error('The PNG encoding options are not available.'
+                           , 'Install PIL (Python Imaging Library) and numpy.'
+                           )
+            if self.options.pngzlevel is not None \
+                and not 0 <= self.options.pngzlevel <= 9:
+                self.error('--png-zlevel must be between 0 and 9.')
+            (pngfilter, pngstrategy) = ((self.options.pngfilter
+                    or 'adaptive:default') + ':default').split(':')[:2]
+            if pngfilter not in PNGEncoder.filters or pngstrategy \
+                not in PNGEncoder.strategies:
+                self.error("Invalid --png-filter '%s'."
+                           % self.options.pngfilter,
+                           "Use 'FILTER[:STRATEGY]' with FILTER one of %s and STRATEGY one of %s."
+                            % (', '.join(PNGEncoder.filters),
+                           ', '.join(sorted(PNGEncoder.strategies))))
+            zlevel = self.options.pngzlevel
+            if zlevel is None:
+                zlevel = 6
+            self.pngencoder = PNGEncoder(zlevel, pngfilter,
+                    pngstrategy, self.options.pngquantize,
+                    self.options.pngoptimize)
+            self.pngbaseline = PNGEncoder()
+
+        # Tile format of every zoom level: 'FORMAT[,ZOOMS:FORMAT...]'
+
+        self.tileformats = {}
+        specs = self.options.format.split(',')
+        self.tileformat = specs[0]
+        for spec in specs[1:]:
+            try:
+                (zooms, tileformat) = spec.split(':')
+                zooms = zooms.split('-', 1)
+                for z in range(int(zooms[0]), int(zooms[-1]) + 1):
+                    self.tileformats[z] = tileformat
+            except ValueError:
+                self.error("Invalid --format '%s'."
+                           % self.options.format,
+                           "Use the format 'FORMAT[,ZOOMS:FORMAT...]', e.g. 'webp,8-9:jpeg'."
+                           )
+        for tileformat in [self.tileformat] \
+            + list(self.tileformats.values()):
+            if tileformat not in format_list:
+                self.error("Unknown tile format '%s'." % tileformat,
+                           'Use one of %s.' % ', '.join(format_list))
+        if self.options.quality < 1 or self.options.quality > 100:
+            self.error('--quality must be between 1 and 100.')
+        (self.tiledriver, self.tileext) = \
+            format_drivers[self.tileformat][:2]
+
+        # Region of the raster to render again
+
+        if self.options.updateregion:
+            try:
+                self.updateregion = tuple(map(float,
+                        self.options.updateregion.split(',')))
+            except ValueError:
+                self.updateregion = ()
+            if len(self.updateregion) != 4 or self.updateregion[2] \
+                <= 0 or self.updateregion[3] <= 0:
+                self.error("Invalid --update-region '%s'."
+                           % self.options.updateregion,
+                           "Use the format 'x,y,width,height'.")
+            if self.options.profile != 'raster':
+                self.error("--update-region is available only for the 'raster' profile."
+                           )
+            if self.options.resume:
+                self.error('--update-region can not be combined with --resume.'
+                           , 'All the tiles of the region are rendered again.'
+                           )
+
+        if self.options.mbtiles:
+            if self.options.shareuniform or self.options.dedup:
+                self.error('--mbtiles can not be combined with --share-uniform or --dedup.'
+                           , 'The MBTiles file stores every distinct tile only once anyway.'
+                           )
+            if self.options.kml:
+                self.error('--mbtiles can not be combined with --force-kml.'
+                           )
+            if self.options.writerthreads:
+                self.error('--mbtiles can not be combined with --writer-threads.'
+                           , 'The tiles are stored by the SQLite connection of the rendering thread.'
+                           )
+
+        if self.options.retina and self.options.kml:
+            self.error('--retina can not be combined with --force-kml.'
+                       , 'The KML files of the normal tiles would be replaced.'
+                       )
+
         # User specified zoom levels
 
         self.tminz = None
@@ -849,6 +1624,97 @@ gdal_vrtmerge.py -o merged.vrt %s"""
                      dest='verbose',
                      help='Print status messages to stdout')
 
+        # Performance options
+
+        g = OptionGroup(p, 'Performance options',
+                        'Options for faster rendering of large rasters')
+        g.add_option('--processes', dest='processes', type='int',
+                     metavar='N',
+                     help='Number of worker processes used for rendering the tiles - default 1 (no parallelism)'
+                     )
+        g.add_option('--strip-read', dest='stripread',
+                     action='store_true',
+                     help="Read every row of base tiles as one strip of the input raster and slice the tiles from it (requires -p raster and numpy)"
+                     )
+        g.add_option('--update-region', dest='updateregion',
+                     metavar='X,Y,W,H',
+                     help='Render again only the tiles intersecting this region of the raster (and their overview tiles), all other tiles are kept'
+                     )
+        g.add_option('--update-region-units', dest='updateunits',
+                     type='choice', choices=('pixel', 'game'),
+                     help="Units of --update-region (pixel,game) - default 'pixel'"
+                     )
+        g.add_option('--game-size', dest='gamesize', type='float',
+                     help='Size of the whole raster in game coordinates for --update-region-units game - default 6144'
+                     )
+        g.add_option('--depth-first', dest='depthfirst',
+                     action='store_true',
+                     help='Render base and overview tiles in one depth-first pass, building every overview tile from its children kept in memory instead of re-reading them from disk'
+                     )
+        g.add_option('--opaque', dest='opaque', type='choice',
+                     choices=('auto', 'yes', 'no'),
+                     help="Write opaque tiles with the data bands only (RGB): no alpha band is read or written - 'yes', 'auto' (when the input has no alpha band and no NODATA) or 'no' (default); the padding of the partial tiles at the edge is black"
+                     )
+        g.add_option('--traversal', dest='traversal', type='choice',
+                     choices=traversal_list,
+                     help="Order of the tiles of a zoom level (%s) - default 'row'; the curves read neighbouring windows of the input close in time, a simulated block cache reports the hits per order"
+                      % ','.join(traversal_list))
+        g.add_option('--writer-threads', dest='writerthreads',
+                     type='int', metavar='N',
+                     help='Encode and write the tiles in N background threads of every rendering process while the next tiles are rendered - default 0 (written inline)'
+                     )
+        g.add_option('--stats-json', dest='statsjson', metavar='PATH',
+                     help='Write the time spent per zoom level in ReadRaster, resampling, encoding/writing, directory creation and child tile reads, and the tiles and bytes written, as JSON to PATH'
+                     )
+        p.add_option_group(g)
+
+        # Output options
+
+        g = OptionGroup(p, 'Output options',
+                        'Options for the way the tiles are stored')
+        g.add_option('--share-uniform', dest='shareuniform',
+                     action='store_true',
+                     help='Write tiles of a single color only once into the _shared directory and link all of them to that file'
+                     )
+        g.add_option('--dedup', dest='dedup', action='store_true',
+                     help='Store every distinct tile only once in the content addressed _shared directory and hard link the {z}/{x}/{y} files to it'
+                     )
+        g.add_option('--format', dest='format',
+                     metavar='FORMAT[,ZOOMS:FORMAT...]',
+                     help="Tile format (%s), optionally different for some zoom levels, e.g. 'webp,8-9:jpeg' (default 'png'). JPEG tiles have no alpha channel."
+                      % ','.join(format_list))
+        g.add_option('--quality', dest='quality', type='int',
+                     help='Quality of the lossy JPEG and WebP tiles, 1-100 (default 85)'
+                     )
+        g.add_option('--png-quantize', dest='pngquantize',
+                     type='float', metavar='RMSE',
+                     help='Reduce PNG tiles to an adaptive palette of 256 colors when the RMSE to the original pixels is at most RMSE (e.g. 2.0)'
+                     )
+        g.add_option('--png-zlevel', dest='pngzlevel', type='int',
+                     metavar='LEVEL',
+                     help='zlib compression level of the PNG tiles, 0-9 (default 6)'
+                     )
+        g.add_option('--png-filter', dest='pngfilter',
+                     metavar='FILTER[:STRATEGY]',
+                     help="PNG scanline filter (%s, default adaptive) and zlib strategy (%s, default default)"
+                      % (','.join(PNGEncoder.filters),
+                     ','.join(sorted(PNGEncoder.strategies))))
+        g.add_option('--png-optimize', dest='pngoptimize',
+                     action='store_true',
+                     help='Try all PNG filters and zlib strategies at level 9 and keep the smallest file (slow)'
+                     )
+        g.add_option('--tilesize', dest='tilesize', type='int',
+                     metavar='N',
+                     help='Size of the tiles in pixels, a power of two from 64 to 4096 - default 256; a zoom level of 512 pixel tiles has the detail of the next zoom level of 256 pixel tiles with a quarter of the tiles (Leaflet tileSize 512 and zoomOffset -1)'
+                     )
+        g.add_option('--retina', dest='retina', action='store_true',
+                     help="Write high-DPI tiles of twice --tilesize pixels on the tile grid of --tilesize, named '{y}@2x.{ext}' next to the normal tiles (Leaflet URL '{y}{r}.png')"
+                     )
+        g.add_option('--mbtiles', dest='mbtiles', metavar='FILE',
+                     help='Write the tiles into one MBTiles (SQLite) file instead of the {z}/{x}/{y} files of the output directory'
+                     )
+        p.add_option_group(g)
+
         # KML options
 
         g = OptionGroup(p, 'KML (Google Earth) options',
@@ -909,6 +1775,23 @@ gdal_vrtmerge.py -o merged.vrt %s"""
             copyright='',
             resampling='average',
             resume=False,
+            processes=1,
+            depthfirst=False,
+            updateunits='pixel',
+            gamesize=6144.0,
+            stripread=False,
+            traversal='row',
+            opaque='no',
+            writerthreads=0,
+            statsjson=None,
+            shareuniform=False,
+            dedup=False,
+            mbtiles=None,
+            tilesize=256,
+            retina=False,
+            format='png',
+            pngoptimize=False,
+            quality=85,
             googlekey='INSERT_YOUR_KEY_HERE',
             bingkey='INSERT_YOUR_KEY_HERE',
             )
@@ -924,12 +1807,16 @@ gdal_vrtmerge.py -o merged.vrt %s"""
 
         # Initialize necessary GDAL drivers
 
-        self.out_drv = gdal.GetDriverByName(self.tiledriver)
         self.mem_drv = gdal.GetDriverByName('MEM')
 
-        if not self.out_drv:
-            raise Exception("The '%s' driver was not found, is it available in this GDAL build?"
-                            , self.tiledriver)
+        self.out_drvs = {}
+        for tileformat in [self.tileformat] \
+            + list(self.tileformats.values()):
+            driver = format_drivers[tileformat][0]
+            self.out_drvs[driver] = gdal.GetDriverByName(driver)
+            if not self.out_drvs[driver]:
+                raise Exception("The '%s' driver was not found, is it available in this GDAL build?"
+                                , driver)
         if not self.mem_drv:
             raise Exception("The 'MEM' driver was not found, is it available in this GDAL build?"
                             )
@@ -953,6 +1840,11 @@ gdal_vrtmerge.py -o merged.vrt %s"""
             self.error("It is not possible to open the input file '%s'."
                         % self.input)
 
+        # No .aux.xml sidecar files next to the tiles (and no lookup of them
+        # when the child tiles are read back), the input has read its own already
+
+        gdal.SetConfigOption('GDAL_PAM_ENABLED', 'NO')
+
         # Read metadata from the input file
 
         if self.in_ds.RasterCount == 0:
@@ -1206,6 +2098,22 @@ gdal2tiles temp.vrt"""
         else:
             self.dataBandsCount = self.out_ds.RasterCount
 
+        # Opaque tiles: the data bands only, the alpha band is neither read nor written
+
+        self.opaque = self.options.opaque == 'yes' \
+            or self.options.opaque == 'auto' \
+            and self.alphaband.GetMaskFlags() == gdal.GMF_ALL_VALID \
+            and self.dataBandsCount == self.out_ds.RasterCount
+        self.tilebands = self.dataBandsCount + (0 if self.opaque else 1)
+
+        # Band lists of the ReadRaster/WriteRaster calls, built once
+
+        self.databandlist = list(range(1, self.dataBandsCount + 1))
+        self.tilebandlist = list(range(1, self.tilebands + 1))
+        if self.options.verbose and self.opaque:
+            print('Opaque tiles with %d bands (no alpha band)'
+                  % self.tilebands)
+
         # KML test
 
         self.isepsg4326 = False
@@ -1213,7 +2121,8 @@ gdal2tiles temp.vrt"""
         srs4326.ImportFromEPSG(4326)
         if self.out_srs and srs4326.ExportToProj4() \
             == self.out_srs.ExportToProj4():
-            self.kml = True
+            self.kml = not self.options.mbtiles \
+                and not self.options.retina
             self.isepsg4326 = True
             if self.options.verbose:
                 print('KML autotest OK!')
@@ -1265,7 +2174,7 @@ gdal2tiles temp.vrt"""
 
         if self.options.profile == 'mercator':
 
-            self.mercator = GlobalMercator()  # from globalmaptiles.py
+            self.mercator = GlobalMercator(self.gridsize)  # from globalmaptiles.py
 
             # Function which generates SWNE in LatLong for given tile
 
@@ -1295,7 +2204,7 @@ gdal2tiles temp.vrt"""
                 self.tminz = \
                     self.mercator.ZoomForPixelSize(self.out_gt[1]
                         * max(self.out_ds.RasterXSize,
-                        self.out_ds.RasterYSize) / float(self.tilesize))
+                        self.out_ds.RasterYSize) / float(self.gridsize))
 
             # Get the maximal zoom level (closest possible zoom level up on the resolution of raster)
 
@@ -1315,7 +2224,8 @@ gdal2tiles temp.vrt"""
 
         if self.options.profile == 'geodetic':
 
-            self.geodetic = GlobalGeodetic(self.options.tmscompatible)  # from globalmaptiles.py
+            self.geodetic = GlobalGeodetic(self.options.tmscompatible,
+                    self.gridsize)  # from globalmaptiles.py
 
             # Function which generates SWNE in LatLong for given tile
 
@@ -1345,7 +2255,7 @@ gdal2tiles temp.vrt"""
                 self.tminz = \
                     self.geodetic.ZoomForPixelSize(self.out_gt[1]
                         * max(self.out_ds.RasterXSize,
-                        self.out_ds.RasterYSize) / float(self.tilesize))
+                        self.out_ds.RasterYSize) / float(self.gridsize))
 
             # Get the maximal zoom level (closest possible zoom level up on the resolution of raster)
 
@@ -1363,9 +2273,9 @@ gdal2tiles temp.vrt"""
 
             self.nativezoom = \
                 int(max(math.ceil(log2(self.out_ds.RasterXSize
-                    / float(self.tilesize))),
+                    / float(self.gridsize))),
                     math.ceil(log2(self.out_ds.RasterYSize
-                    / float(self.tilesize)))))
+                    / float(self.gridsize)))))
 
             if int(self.tmaxz or 0) < self.nativezoom:
                 self.tmaxz = self.nativezoom
@@ -1388,7 +2298,7 @@ gdal2tiles temp.vrt"""
             self.tminmax = list(range(0, self.tmaxz + 1))
             self.tsize = list(range(0, self.tmaxz + 1))
             for tz in range(0, self.tmaxz + 1):
-                tsize = 2.0 ** (self.nativezoom - tz) * self.tilesize
+                tsize = 2.0 ** (self.nativezoom - tz) * self.gridsize
                 (tminx, tminy) = (0, 0)
                 tmaxx = int(math.ceil(self.out_ds.RasterXSize / tsize)) \
                     - 1
@@ -1406,11 +2316,11 @@ gdal2tiles temp.vrt"""
                 def rastertileswne(x, y, z):
                     pixelsizex = 2 ** (self.tmaxz - z) * self.out_gt[1]  # X-pixel size in level
                     pixelsizey = 2 ** (self.tmaxz - z) * self.out_gt[1]  # Y-pixel size in level (usually -1*pixelsizex)
-                    west = self.out_gt[0] + x * self.tilesize \
+                    west = self.out_gt[0] + x * self.gridsize \
                         * pixelsizex
-                    east = west + self.tilesize * pixelsizex
-                    south = self.ominy + y * self.tilesize * pixelsizex
-                    north = south + self.tilesize * pixelsizex
+                    east = west + self.gridsize * pixelsizex
+                    south = self.ominy + y * self.gridsize * pixelsizex
+                    north = south + self.gridsize * pixelsizex
                     if not self.isepsg4326:
 
                         # Transformation to EPSG:4326 (WGS84 datum)
@@ -1425,6 +2335,74 @@ gdal2tiles temp.vrt"""
             else:
                 self.tileswne = lambda x, y, z: (0, 0, 0, 0)
 
+        # Restriction of the rendering to the tiles of the changed region
+
+        if self.updateregion:
+            self.open_update_region()
+
+    # -------------------------------------------------------------------------
+
+    def tile_range(self, tz):
+        """Returns the range (tminx, tminy, tmaxx, tmaxy) of the tiles to render in the zoom level,
+        which is restricted by --update-region"""
+
+        if self.updateminmax:
+            return self.updateminmax[tz]
+        return self.tminmax[tz]
+
+    # -------------------------------------------------------------------------
+
+    def open_update_region(self):
+        """Calculation of the tiles covering the --update-region in all the zoom levels"""
+
+        (x, y, w, h) = self.updateregion
+        if self.options.updateunits == 'game':
+
+            # Game coordinates cover the whole raster
+
+            (scalex, scaley) = (self.out_ds.RasterXSize
+                                / self.options.gamesize,
+                                self.out_ds.RasterYSize
+                                / self.options.gamesize)
+            (x, y, w, h) = (x * scalex, y * scaley, w * scalex, h
+                            * scaley)
+
+        # Pixel bounds of the region, rows counted from the top of the raster
+
+        px0 = max(0, int(math.floor(x)))
+        py0 = max(0, int(math.floor(y)))
+        px1 = min(self.out_ds.RasterXSize, int(math.ceil(x + w)))
+        py1 = min(self.out_ds.RasterYSize, int(math.ceil(y + h)))
+        if px0 >= px1 or py0 >= py1:
+            self.error('The update region %s is outside of the raster.'
+                        % self.options.updateregion)
+
+        # Base tiles intersecting the region
+
+        tsize = self.tsize[self.tmaxz]
+        (tminx, tminy, tmaxx, tmaxy) = self.tminmax[self.tmaxz]
+        (minx, maxx) = (px0 // tsize, (px1 - 1) // tsize)
+        if self.options.leaflet:
+            (miny, maxy) = (py0 // tsize, (py1 - 1) // tsize)
+        else:
+            ysize = self.out_ds.RasterYSize
+            (miny, maxy) = ((ysize - py1) // tsize, (ysize - 1 - py0)
+                            // tsize)
+
+        # Propagate upwards: the overview tiles built from those tiles
+
+        self.updateminmax = {}
+        for tz in range(self.tmaxz, self.tminz - 1, -1):
+            (tminx, tminy, tmaxx, tmaxy) = self.tminmax[tz]
+            self.updateminmax[tz] = (max(tminx, minx), max(tminy, miny),
+                                     min(tmaxx, maxx), min(tmaxy, maxy))
+            (minx, miny, maxx, maxy) = (minx // 2, miny // 2, maxx
+                                        // 2, maxy // 2)
+
+        if self.options.verbose:
+            print ('Update region (pixels):', (px0, py0, px1, py1))
+            print ('Update tile ranges:', self.updateminmax)
+
     # -------------------------------------------------------------------------
 
     def generate_metadata(self):
@@ -1554,7 +2532,7 @@ gdal2tiles temp.vrt"""
 
         # Set the bounds
 
-        (tminx, tminy, tmaxx, tmaxy) = self.tminmax[self.tmaxz]
+        (tminx, tminy, tmaxx, tmaxy) = self.tile_range(self.tmaxz)
 
         # Just the center tile
         # tminx = tminx+ (tmaxx - tminx)/2
@@ -1562,9 +2540,7 @@ gdal2tiles temp.vrt"""
         # tmaxx = tminx
         # tmaxy = tminy
 
-        ds = self.out_ds
-        tilebands = self.dataBandsCount + 1
-        querysize = self.querysize
+        tilebands = self.tilebands
 
         if self.options.verbose:
             print ('dataBandsCount: ', self.dataBandsCount)
@@ -1579,122 +2555,256 @@ gdal2tiles temp.vrt"""
         ti = 0
 
         tz = self.tmaxz
-        yrange = range(tmaxy, tminy - 1, -1)
-        if self.options.leaflet:
-            yrange = range(tminy, tmaxy + 1)
+        tiles = self.tile_order(tminx, tminy, tmaxx, tmaxy)
+        self.make_tile_dirs(tz, tminx, tmaxx)
 
-        for ty in yrange:
-            for tx in range(tminx, tmaxx + 1):
+        if self.pool:
 
-                if self.stopped:
-                    break
-                ti += 1
-                tilefilename = os.path.join(self.output, str(tz),
-                        str(tx), '%s.%s' % (ty, self.tileext))
-                if self.options.verbose:
-                    print (ti, '/', tcount, tilefilename)  # , "( TileMapService: z / x / y )"
+            # One job per row of tiles (as many tiles in the order of --traversal),
+            # rendered by the worker processes
 
-                if self.options.resume and os.path.exists(tilefilename):
-                    if self.options.verbose:
-                        print('Tile generation skiped because of --resume')
-                    else:
-                        self.progressbar(ti / float(tcount))
-                    continue
+            jobs = self.tile_jobs(tz, tiles, tmaxx - tminx + 1)
+            self.run_parallel(worker_base_tiles, jobs, tcount)
+            return
 
-                # Create directories for the tile
+        for (tx, ty) in tiles:
 
-                if not os.path.exists(os.path.dirname(tilefilename)):
-                    os.makedirs(os.path.dirname(tilefilename))
+            if self.stopped:
+                break
+            ti += 1
+            if self.options.verbose:
+                print (ti, '/', tcount, self.tile_filename(tx, ty, tz))  # , "( TileMapService: z / x / y )"
 
-                if self.options.profile == 'mercator':
+            self.generate_base_tile(tx, ty, tz)
 
-                    # Tile bounds in EPSG:900913
+            if not self.options.verbose:
+                self.progressbar(ti / float(tcount))
 
-                    b = self.mercator.TileBounds(tx, ty, tz)
-                elif self.options.profile == 'geodetic':
-                    b = self.geodetic.TileBounds(tx, ty, tz)
+        # The overview tiles read the base tiles back from disk
 
-                # print("\tgdalwarp -ts 256 256 -te %s %s %s %s %s %s_%s_%s.tif" % ( b[0], b[1], b[2], b[3], "tiles.vrt", tz, tx, ty))
+        if self.writer:
+            self.writer.flush()
 
-                # Don't scale up by nearest neighbour, better change the querysize
-                # to the native resolution (and return smaller query tile) for scaling
+    # -------------------------------------------------------------------------
 
-                if self.options.profile in ('mercator', 'geodetic'):
-                    (rb, wb) = self.geo_query(ds, b[0], b[3], b[2],
-                            b[1])
-                    nativesize = wb[0] + wb[2]  # Pixel size in the raster covering query geo extent
-                    if self.options.verbose:
-                        print ('\tNative Extent (querysize',
-                               nativesize, '): ', rb, wb)
-
-                    # Tile bounds in raster coordinates for ReadRaster query
-
-                    (rb, wb) = self.geo_query(
-                        ds,
-                        b[0],
-                        b[3],
-                        b[2],
-                        b[1],
-                        querysize=querysize,
-                        )
+    def tile_order(
+        self,
+        tminx,
+        tminy,
+        tmaxx,
+        tmaxy,
+        ):
+        """Returns the tiles (tx, ty) of the range in the order of --traversal"""
 
-                    (rx, ry, rxsize, rysize) = rb
-                    (wx, wy, wxsize, wysize) = wb
+        yrange = range(tmaxy, tminy - 1, -1)
+        if self.options.leaflet:
+            yrange = range(tminy, tmaxy + 1)
+        tiles = [(tx, ty) for ty in yrange for tx in range(tminx, tmaxx
+                 + 1)]
+
+        # The curves run over the rows counted from the top of the raster
+
+        if self.options.traversal == 'morton':
+            tiles.sort(key=lambda t: morton_key(t[0] - tminx,
+                       abs(t[1] - yrange[0])))
+        elif self.options.traversal == 'hilbert':
+            n = 1
+            while n <= max(tmaxx - tminx, tmaxy - tminy):
+                n *= 2
+            tiles.sort(key=lambda t: hilbert_key(n, t[0] - tminx,
+                       abs(t[1] - yrange[0])))
+        return tiles
+
+    # -------------------------------------------------------------------------
+
+    def tile_jobs(
+        self,
+        tz,
+        tiles,
+        size,
+        ):
+        """Split the ordered tiles into jobs of the worker processes"""
+
+        return [(tz, tiles[i:i + size]) for i in range(0, len(tiles),
+                size)]
+
+    # -------------------------------------------------------------------------
+
+    def simulate_block_cache(
+        self,
+        tz,
+        rx,
+        ry,
+        rxsize,
+        rysize,
+        ):
+        """Count the hits and misses of the blocks of the input read by a ReadRaster query
+        in a simulated LRU block cache of the size of GDAL_CACHEMAX, per process as GDAL's
+        cache, to compare the locality of the --traversal orders"""
+
+        if self.blockcache is None:
+            (bx, by) = self.out_ds.GetRasterBand(1).GetBlockSize()
+            self.blocksize = (bx, by)
+            self.blockcachesize = max(1, gdal.GetCacheMax() // (bx * by
+                    * self.out_ds.RasterCount))
+            self.blockcache = collections.OrderedDict()
+        (bx, by) = self.blocksize
+        (hits, misses) = (0, 0)
+        for y in range(ry // by, (ry + rysize - 1) // by + 1):
+            for x in range(rx // bx, (rx + rxsize - 1) // bx + 1):
+                if (x, y) in self.blockcache:
+                    self.blockcache.move_to_end((x, y))
+                    hits += 1
                 else:
+                    self.blockcache[(x, y)] = True
+                    misses += 1
+                    if len(self.blockcache) > self.blockcachesize:
+                        self.blockcache.popitem(last=False)
+        self.count(tz, 'blockhits', hits)
+        self.count(tz, 'blockmisses', misses)
 
-                      # 'raster' profile:
-
-                    tsize = int(self.tsize[tz])  # tilesize in raster coordinates for actual zoom
-                    xsize = self.out_ds.RasterXSize  # size of the raster in pixels
-                    ysize = self.out_ds.RasterYSize
-                    if tz >= self.nativezoom:
-                        querysize = self.tilesize  # int(2**(self.nativezoom-tz) * self.tilesize)
-
-                    rx = tx * tsize
-                    rxsize = 0
-                    if tx == tmaxx:
-                        rxsize = xsize % tsize
-                    if rxsize == 0:
-                        rxsize = tsize
-
-                    rysize = 0
-                    if ty == tmaxy:
-                        rysize = ysize % tsize
-                    if rysize == 0:
-                        rysize = tsize
-                    if self.options.leaflet:
-                        ry = ty * tsize
-                    else:
-                        ry = ysize - ty * tsize - rysize
+    # -------------------------------------------------------------------------
+
+    def generate_base_tile(
+        self,
+        tx,
+        ty,
+        tz,
+        ):
+        """Generation of one base tile directly from the input raster, returns the tile dataset"""
 
-                    (wx, wy) = (0, 0)
-                    (wxsize, wysize) = (int(rxsize / float(tsize)
-                            * self.tilesize), int(rysize / float(tsize)
-                            * self.tilesize))
-                    if not self.options.leaflet:
-                        if wysize != self.tilesize:
-                            wy = self.tilesize - wysize
+        (tminx, tminy, tmaxx, tmaxy) = self.tminmax[tz]
+        ds = self.out_ds
+        tilebands = self.tilebands
+        querysize = self.querysize
 
-                if self.options.verbose:
-                    print ('\tReadRaster Extent: ', (rx, ry, rxsize,
-                           rysize), (wx, wy, wxsize, wysize))
+        tilefilename = self.tile_filename(tx, ty, tz)
 
-                # Query is in 'nearest neighbour' but can be bigger in then the tilesize
-                # We scale down the query to the tilesize by supplied algorithm.
+        if self.options.resume and self.tile_done(tz, tx, ty,
+                tilefilename):
+            if self.options.verbose:
+                print('Tile generation skiped because of --resume')
+            return None
 
-                # Tile dataset in memory
+        # Create directories for the tile
 
-                dstile = self.mem_drv.Create('', self.tilesize,
-                        self.tilesize, tilebands)
-                data = ds.ReadRaster(
-                    rx,
-                    ry,
-                    rxsize,
-                    rysize,
-                    wxsize,
-                    wysize,
-                    band_list=list(range(1, self.dataBandsCount + 1)),
-                    )
+        if not self.options.mbtiles:
+            self.make_tile_dir(tz, tx)
+
+        if self.options.profile == 'mercator':
+
+            # Tile bounds in EPSG:900913
+
+            b = self.mercator.TileBounds(tx, ty, tz)
+        elif self.options.profile == 'geodetic':
+            b = self.geodetic.TileBounds(tx, ty, tz)
+
+        # print("\tgdalwarp -ts 256 256 -te %s %s %s %s %s %s_%s_%s.tif" % ( b[0], b[1], b[2], b[3], "tiles.vrt", tz, tx, ty))
+
+        # Don't scale up by nearest neighbour, better change the querysize
+        # to the native resolution (and return smaller query tile) for scaling
+
+        if self.options.profile in ('mercator', 'geodetic'):
+            (rb, wb) = self.geo_query(ds, b[0], b[3], b[2],
+                    b[1])
+            nativesize = wb[0] + wb[2]  # Pixel size in the raster covering query geo extent
+            if self.options.verbose:
+                print ('\tNative Extent (querysize',
+                       nativesize, '): ', rb, wb)
+
+            # Tile bounds in raster coordinates for ReadRaster query
+
+            (rb, wb) = self.geo_query(
+                ds,
+                b[0],
+                b[3],
+                b[2],
+                b[1],
+                querysize=querysize,
+                )
+
+            (rx, ry, rxsize, rysize) = rb
+            (wx, wy, wxsize, wysize) = wb
+        else:
+
+              # 'raster' profile:
+
+            tsize = int(self.tsize[tz])  # tilesize in raster coordinates for actual zoom
+            xsize = self.out_ds.RasterXSize  # size of the raster in pixels
+            ysize = self.out_ds.RasterYSize
+
+            # No bigger query when the tile has at most as many pixels as
+            # its window of the raster (the native zoom, or one below for --retina)
+
+            if tsize <= self.tilesize:
+                querysize = self.tilesize  # int(2**(self.nativezoom-tz) * self.tilesize)
+
+            rx = tx * tsize
+            rxsize = 0
+            if tx == tmaxx:
+                rxsize = xsize % tsize
+            if rxsize == 0:
+                rxsize = tsize
+
+            rysize = 0
+            if ty == tmaxy:
+                rysize = ysize % tsize
+            if rysize == 0:
+                rysize = tsize
+            if self.options.leaflet:
+                ry = ty * tsize
+            else:
+                ry = ysize - ty * tsize - rysize
+
+            # A narrow edge of the raster is at least one pixel of the tile
+
+            (wx, wy) = (0, 0)
+            (wxsize, wysize) = (max(1, int(rxsize / float(tsize)
+                                * self.tilesize)), max(1, int(rysize
+                                / float(tsize) * self.tilesize)))
+            if not self.options.leaflet:
+                if wysize != self.tilesize:
+                    wy = self.tilesize - wysize
+
+        if self.options.verbose:
+            print ('\tReadRaster Extent: ', (rx, ry, rxsize,
+                   rysize), (wx, wy, wxsize, wysize))
+
+        # Query is in 'nearest neighbour' but can be bigger in then the tilesize
+        # We scale down the query to the tilesize by supplied algorithm.
+
+        # Tile dataset in memory (cleared only if the window does not cover it)
+
+        partial = wxsize < querysize or wysize < querysize
+        dstile = self.mem_dataset(tz, 'tile', self.tilesize, tilebands,
+                                  partial and self.tilesize == querysize)
+
+        if self.options.stripread and self.tilesize == querysize:
+
+            # Slice the tile out of the strip with the whole row of tiles
+
+            (stripdata, stripalpha) = self.read_strip(ty, tz)
+            sx = (tx - tminx) * self.tilesize
+            for i in range(self.dataBandsCount):
+                dstile.GetRasterBand(i + 1).WriteArray(stripdata[i, :,
+                        sx:sx + wxsize], wx, wy)
+            if not self.opaque:
+                dstile.GetRasterBand(tilebands).WriteArray(stripalpha[:
+                        , sx:sx + wxsize], wx, wy)
+        else:
+            self.simulate_block_cache(tz, rx, ry, rxsize, rysize)
+            start = time.time()
+            data = ds.ReadRaster(
+                rx,
+                ry,
+                rxsize,
+                rysize,
+                wxsize,
+                wysize,
+                band_list=self.databandlist,
+                )
+            alpha = None
+            if not self.opaque:
                 alpha = self.alphaband.ReadRaster(
                     rx,
                     ry,
@@ -1703,20 +2813,22 @@ gdal2tiles temp.vrt"""
                     wxsize,
                     wysize,
                     )
+            self.count(tz, 'readrasters')
+            self.count_time(tz, 'readrastertime', start)
 
-                if self.tilesize == querysize:
+            if self.tilesize == querysize:
 
-                    # Use the ReadRaster result directly in tiles ('nearest neighbour' query)
+                # Use the ReadRaster result directly in tiles ('nearest neighbour' query)
 
-                    dstile.WriteRaster(
-                        wx,
-                        wy,
-                        wxsize,
-                        wysize,
-                        data,
-                        band_list=list(range(1, self.dataBandsCount
-                                + 1)),
-                        )
+                dstile.WriteRaster(
+                    wx,
+                    wy,
+                    wxsize,
+                    wysize,
+                    data,
+                    band_list=self.databandlist,
+                    )
+                if alpha is not None:
                     dstile.WriteRaster(
                         wx,
                         wy,
@@ -1725,29 +2837,29 @@ gdal2tiles temp.vrt"""
                         alpha,
                         band_list=[tilebands],
                         )
-                else:
+            else:
 
-                    # Note: For source drivers based on WaveLet compression (JPEG2000, ECW, MrSID)
-                    # the ReadRaster function returns high-quality raster (not ugly nearest neighbour)
-                    # TODO: Use directly 'near' for WaveLet files
-                    # Big ReadRaster query in memory scaled to the tilesize - all but 'near' algo
+                # Note: For source drivers based on WaveLet compression (JPEG2000, ECW, MrSID)
+                # the ReadRaster function returns high-quality raster (not ugly nearest neighbour)
+                # TODO: Use directly 'near' for WaveLet files
+                # Big ReadRaster query in memory scaled to the tilesize - all but 'near' algo
 
-                    dsquery = self.mem_drv.Create('', querysize,
-                            querysize, tilebands)
+                dsquery = self.mem_dataset(tz, 'query', querysize,
+                        tilebands, partial)
 
-                    # TODO: fill the null value in case a tile without alpha is produced (now only png tiles are supported)
-                    # for i in range(1, tilebands+1):
-                    #   dsquery.GetRasterBand(1).Fill(tilenodata)
+                # TODO: fill the null value in case a tile without alpha is produced (now only png tiles are supported)
+                # for i in range(1, tilebands+1):
+                #   dsquery.GetRasterBand(1).Fill(tilenodata)
 
-                    dsquery.WriteRaster(
-                        wx,
-                        wy,
-                        wxsize,
-                        wysize,
-                        data,
-                        band_list=list(range(1, self.dataBandsCount
-                                + 1)),
-                        )
+                dsquery.WriteRaster(
+                    wx,
+                    wy,
+                    wxsize,
+                    wysize,
+                    data,
+                    band_list=self.databandlist,
+                    )
+                if alpha is not None:
                     dsquery.WriteRaster(
                         wx,
                         wy,
@@ -1757,34 +2869,761 @@ gdal2tiles temp.vrt"""
                         band_list=[tilebands],
                         )
 
-                    self.scale_query_to_tile(dsquery, dstile,
-                            tilefilename)
-                    del dsquery
+                start = time.time()
+                self.scale_query_to_tile(dsquery, dstile,
+                        tilefilename)
+                self.count(tz, 'scales')
+                self.count_time(tz, 'scaletime', start)
 
-                del data
+            del data
 
-                if self.options.resampling != 'antialias':
+        # Write a copy of tile to png/jpg
 
-                    # Write a copy of tile to png/jpg
+        start = time.time()
+        self.write_tile(dstile, tilefilename, tx, ty, tz)
+        self.count_time(tz, 'writetime', start)
 
-                    self.out_drv.CreateCopy(tilefilename, dstile,
-                            strict=0)
+        # Create a KML file for this tile.
 
-                del dstile
+        if self.kml:
+            kmlfilename = os.path.join(self.output, str(tz),
+                    str(tx), '%d.kml' % ty)
+            if not self.options.resume \
+                or not os.path.exists(kmlfilename):
+                f = open(kmlfilename, 'w')
+                f.write(self.generate_kml(tx, ty, tz))
+                f.close()
 
-                # Create a KML file for this tile.
+        # The writer thread records a queued tile once it is written
 
-                if self.kml:
-                    kmlfilename = os.path.join(self.output, str(tz),
-                            str(tx), '%d.kml' % ty)
-                    if not self.options.resume \
-                        or not os.path.exists(kmlfilename):
-                        f = open(kmlfilename, 'w')
-                        f.write(self.generate_kml(tx, ty, tz))
-                        f.close()
+        if not self.writer:
+            self.journal.add(tz, tx, ty)
+        return dstile
 
-                if not self.options.verbose:
-                    self.progressbar(ti / float(tcount))
+
+    # -------------------------------------------------------------------------
+
+    def open_mbtiles(self, clear=False):
+        """Open the --mbtiles output file"""
+
+        if clear:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(self.options.mbtiles + suffix):
+                    os.unlink(self.options.mbtiles + suffix)
+        self.mbtiles = MBTiles(self.options.mbtiles,
+                               self.options.leaflet)
+
+    # -------------------------------------------------------------------------
+
+    def mbtiles_metadata(self):
+        """Write the metadata table of the --mbtiles output file"""
+
+        metadata = {
+            'name': self.options.title or os.path.basename(self.input),
+            'format': self.tileext,
+            'type': 'baselayer',
+            'version': '1.1',
+            'description': self.options.copyright,
+            'minzoom': self.tminz,
+            'maxzoom': self.tmaxz,
+            }
+        if self.options.profile == 'mercator':
+            (south, west) = self.mercator.MetersToLatLon(self.ominx,
+                    self.ominy)
+            (north, east) = self.mercator.MetersToLatLon(self.omaxx,
+                    self.omaxy)
+            metadata['bounds'] = '%f,%f,%f,%f' % (west, south, east,
+                    north)
+        elif self.options.profile == 'geodetic':
+            metadata['bounds'] = '%f,%f,%f,%f' % (self.ominx,
+                    self.ominy, self.omaxx, self.omaxy)
+        self.mbtiles.set_metadata(metadata)
+
+    # -------------------------------------------------------------------------
+
+    def open_writer(self):
+        """Start the background writer threads of --writer-threads. Not with KML output:
+        the KML file of a tile is written after the tile, before the tile is journaled."""
+
+        self.writer = None
+        if self.options.writerthreads and not self.kml:
+            self.writer = TileWriter(self.write_queued_tile,
+                    self.options.writerthreads, 4
+                    * self.options.writerthreads)
+
+    # -------------------------------------------------------------------------
+
+    def make_tile_dirs(
+        self,
+        tz,
+        tminx,
+        tmaxx,
+        ):
+        """Create the directories of the columns tminx..tmaxx of the zoom level at once"""
+
+        if not self.options.mbtiles:
+            for tx in range(tminx, tmaxx + 1):
+                self.make_tile_dir(tz, tx)
+
+    # -------------------------------------------------------------------------
+
+    def make_tile_dir(self, tz, tx):
+        """Create the directory of the tile column, tested only once per process"""
+
+        if (tz, tx) in self.tiledirs:
+            return
+        start = time.time()
+        dirname = os.path.join(self.output, str(tz), str(tx))
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+                self.count(tz, 'mkdirs')
+            except OSError:
+                pass  # Created by another worker process
+        self.tiledirs.add((tz, tx))
+        self.count_time(tz, 'mkdirtime', start)
+
+    # -------------------------------------------------------------------------
+
+    def open_journal(self, clear=False):
+        """Open the journal of the completed tiles, replay it for --resume.
+        With --mbtiles the committed tiles of the database are replayed instead."""
+
+        path = os.path.join(self.output, '.journal' + self.tilesuffix)
+        if clear and os.path.exists(path):
+            shutil.rmtree(path)
+        self.journal = TileJournal(path)
+        self.journaldone = None
+        if self.options.resume and self.mbtiles:
+            self.journaldone = self.mbtiles.replay()
+        elif self.options.resume:
+            self.journaldone = self.journal.replay()
+
+            # Output of an older version without a journal: test the tile files
+
+            if not self.journaldone:
+                self.journaldone = None
+
+    # -------------------------------------------------------------------------
+
+    def tile_done(
+        self,
+        tz,
+        tx,
+        ty,
+        tilefilename,
+        ):
+        """Is the tile already completed (for --resume)?"""
+
+        if self.journaldone is not None:
+            return (tx, ty) in self.journaldone.get(tz, ())
+        return os.path.exists(tilefilename)
+
+    # -------------------------------------------------------------------------
+
+    def write_tile(
+        self,
+        dstile,
+        tilefilename,
+        tx,
+        ty,
+        tz,
+        ):
+        """Write the tile dataset, with --writer-threads a copy of its raster data is queued
+        for the writer threads (the pooled tile dataset is reused for the next tile)"""
+
+        if self.writer:
+            self.writer.put((dstile.ReadRaster(0, 0, self.tilesize,
+                            self.tilesize), dstile.RasterCount,
+                            tilefilename, tx, ty, tz))
+        else:
+            self.save_tile(dstile, tilefilename, tx, ty, tz)
+
+    # -------------------------------------------------------------------------
+
+    def save_tile(
+        self,
+        dstile,
+        tilefilename,
+        tx,
+        ty,
+        tz,
+        ):
+        """Encode the tile dataset into the tile file (or the MBTiles file), uniform tiles are linked
+        to a shared file"""
+
+        if self.mbtiles:
+            data = self.encode_tile(dstile, tz)
+            self.count(tz, 'tiles')
+            self.count(tz, 'bytes', len(data))
+            if self.mbtiles.put(tz, tx, ty, data):
+                self.count(tz, 'unique')
+                self.count(tz, 'storedbytes', len(data))
+            self.count_written(tz, len(data))
+            return
+
+        if self.options.shareuniform:
+            color = self.uniform_color(dstile.ReadRaster(0, 0,
+                    self.tilesize, self.tilesize), dstile.RasterCount)
+            if color:
+                filename = self.uniform_tile(color, dstile, tz)
+                self.link_tile(filename, tilefilename)
+                self.count(tz, 'uniform')
+                self.count_written(tz, os.path.getsize(filename))
+                return
+
+        if self.options.dedup:
+            data = self.encode_tile(dstile, tz)
+            self.link_tile(self.store_tile(data, tz), tilefilename)
+            self.count_written(tz, len(data))
+            return
+
+        # Write a temporary file and rename it: a killed process never leaves
+        # a partial tile and a link to a shared tile is replaced, not written through
+
+        tempfilename = '%s.%d.tmp' % (tilefilename,
+                threading.get_native_id())
+        self.create_copy(tempfilename, dstile, tz)
+        self.count_written(tz, os.path.getsize(tempfilename))
+        os.rename(tempfilename, tilefilename)
+
+    # -------------------------------------------------------------------------
+
+    def write_queued_tile(
+        self,
+        data,
+        bands,
+        tilefilename,
+        tx,
+        ty,
+        tz,
+        ):
+        """Writer thread: write the raster data of a queued tile, then record it in the journal"""
+
+        start = time.time()
+        dstile = self.mem_dataset(tz, 'writer', self.tilesize, bands,
+                                  False)
+        dstile.WriteRaster(0, 0, self.tilesize, self.tilesize, data)
+        self.save_tile(dstile, tilefilename, tx, ty, tz)
+        self.count_time(tz, 'writertime', start)
+        self.journal.add(tz, tx, ty)
+
+    # -------------------------------------------------------------------------
+
+    def mem_dataset(
+        self,
+        tz,
+        name,
+        size,
+        bands,
+        clear=True,
+        ):
+        """Returns the pooled MEM dataset (size x size) of the purpose, created on first use
+        and reused for all the following tiles of the thread, filled with zeros if clear"""
+
+        key = (name, size, bands, threading.get_ident())
+        ds = self.mempool.get(key)
+        if ds is None:
+            ds = self.mem_drv.Create('', size, size, bands)
+            self.mempool[key] = ds
+            self.count(tz, 'allocated')
+            return ds
+        self.count(tz, 'reused')
+        if clear:
+            for i in range(bands):
+                ds.GetRasterBand(i + 1).Fill(0)
+        return ds
+
+    # -------------------------------------------------------------------------
+
+    def tile_format(self, tz):
+        """Returns the GDAL driver, file extension and creation options of the tiles of the zoom level"""
+
+        (driver, ext, options) = \
+            format_drivers[self.tileformats.get(tz, self.tileformat)]
+        return (self.out_drvs[driver], ext, [o % self.options.quality
+                if '%d' in o else o for o in options])
+
+    # -------------------------------------------------------------------------
+
+    def tile_filename(
+        self,
+        tx,
+        ty,
+        tz,
+        ):
+        """Returns the file name of the tile in the output directory"""
+
+        return os.path.join(self.output, str(tz), str(tx), '%s%s.%s'
+                            % (ty, self.tilesuffix,
+                            self.tile_format(tz)[1]))
+
+    # -------------------------------------------------------------------------
+
+    def create_copy(
+        self,
+        filename,
+        dstile,
+        tz,
+        ):
+        """Encode the tile dataset into the file in the tile format of the zoom level"""
+
+        (drv, ext, options) = self.tile_format(tz)
+
+        if self.pngencoder and drv.ShortName == 'PNG':
+            data = self.encode_png(dstile, tz)
+            if filename.startswith('/vsimem/'):
+                gdal.FileFromMemBuffer(filename, data)
+            else:
+                f = open(filename, 'wb')
+                f.write(data)
+                f.close()
+            return
+
+        # JPEG has no alpha channel, copy the data bands only
+
+        if drv.ShortName == 'JPEG' and not self.opaque:
+            bands = self.databandlist
+            dsdata = self.mem_dataset(tz, 'jpeg', dstile.RasterXSize,
+                    len(bands), False)
+            dsdata.WriteRaster(
+                0,
+                0,
+                dstile.RasterXSize,
+                dstile.RasterYSize,
+                dstile.ReadRaster(0, 0, dstile.RasterXSize,
+                                  dstile.RasterYSize, band_list=bands),
+                band_list=bands,
+                )
+            dstile = dsdata
+
+        drv.CreateCopy(filename, dstile, strict=0, options=options)
+
+    # -------------------------------------------------------------------------
+
+    def encode_png(self, dstile, tz):
+        """Encode the tile dataset by the PNG encoding stage, returns the file content"""
+
+        (w, h, bands) = (dstile.RasterXSize, dstile.RasterYSize,
+                         dstile.RasterCount)
+        array = numpy.frombuffer(dstile.ReadRaster(
+            0,
+            0,
+            w,
+            h,
+            buf_pixel_space=bands,
+            buf_line_space=bands * w,
+            buf_band_space=1,
+            ), numpy.uint8).reshape(h, w, bands)
+        (data, quantized) = self.pngencoder.encode(array)
+
+        # Size of the tile as written without the encoding stage
+
+        self.count(tz, 'pngtiles')
+        self.count(tz, 'pngbasebytes',
+                   len(self.pngbaseline.encode(array)[0]))
+        self.count(tz, 'pngbytes', len(data))
+        if quantized:
+            self.count(tz, 'pngquantized')
+        return data
+
+    # -------------------------------------------------------------------------
+
+    def count_written(self, tz, size):
+        """Count the tile written in the zoom level and its encoded size"""
+
+        self.count(tz, 'written')
+        self.count(tz, 'writtenbytes', size)
+
+    # -------------------------------------------------------------------------
+
+    def encode_tile(self, dstile, tz):
+        """Encode the tile dataset in the tile format of the zoom level in memory, returns the file content"""
+
+        vsifilename = '/vsimem/gdal2tiles-%d.%s' \
+            % (threading.get_native_id(), self.tile_format(tz)[1])
+        self.create_copy(vsifilename, dstile, tz)
+        f = gdal.VSIFOpenL(vsifilename, 'rb')
+        gdal.VSIFSeekL(f, 0, 2)
+        size = gdal.VSIFTellL(f)
+        gdal.VSIFSeekL(f, 0, 0)
+        data = gdal.VSIFReadL(1, size, f)
+        gdal.VSIFCloseL(f)
+        gdal.Unlink(vsifilename)
+        return data
+
+    # -------------------------------------------------------------------------
+
+    def store_tile(self, data, tz):
+        """Store the encoded tile once in the content addressed store, returns its file name"""
+
+        digest = hashlib.sha1(data).hexdigest()
+        filename = os.path.join(self.output, '_shared', digest[:2],
+                                '%s.%s' % (digest,
+                                self.tile_format(tz)[1]))
+        self.count(tz, 'tiles')
+        self.count(tz, 'bytes', len(data))
+        if os.path.exists(filename):
+            return filename
+
+        if not os.path.exists(os.path.dirname(filename)):
+            try:
+                os.makedirs(os.path.dirname(filename))
+            except OSError:
+                pass  # Created by another worker process
+
+        # Link the complete temporary file into the store, only the first process succeeds
+
+        tempfilename = '%s.%d.tmp' % (filename,
+                threading.get_native_id())
+        f = open(tempfilename, 'wb')
+        f.write(data)
+        f.close()
+        try:
+            os.link(tempfilename, filename)
+            self.count(tz, 'unique')
+            self.count(tz, 'storedbytes', len(data))
+        except OSError:
+            if not os.path.exists(filename):
+                os.rename(tempfilename, filename)
+                self.count(tz, 'unique')
+                self.count(tz, 'storedbytes', len(data))
+        if os.path.exists(tempfilename):
+            os.unlink(tempfilename)
+        return filename
+
+    # -------------------------------------------------------------------------
+
+    def uniform_color(self, data, bands):
+        """Returns the color of uniform raster data (band sequential bytes) or None"""
+
+        n = len(data) // bands
+        color = []
+        for i in range(bands):
+            c = data[i * n]
+            if data.count(bytes((c, )), i * n, (i + 1) * n) != n:
+                return None
+            color.append(c)
+        return tuple(color)
+
+    # -------------------------------------------------------------------------
+
+    def uniform_dir(self):
+        """Returns the directory of the shared uniform tiles of the tile size
+        (256 and @2x tiles share the output directory)"""
+
+        if self.tilesize == 256:
+            return os.path.join(self.output, '_shared', 'uniform')
+        return os.path.join(self.output, '_shared', 'uniform-%d'
+                            % self.tilesize)
+
+    # -------------------------------------------------------------------------
+
+    def uniform_tile(
+        self,
+        color,
+        dstile,
+        tz,
+        ):
+        """Returns the shared file for uniform tiles of given color, written on first use"""
+
+        filename = os.path.join(self.uniform_dir(), 'uniform-%s.%s'
+                                % (''.join('%02x' % c for c in color),
+                                self.tile_format(tz)[1]))
+        if not os.path.exists(filename):
+            if not os.path.exists(os.path.dirname(filename)):
+                try:
+                    os.makedirs(os.path.dirname(filename))
+                except OSError:
+                    pass  # Created by another worker process
+
+            # Write to a temporary file first, other worker processes may link to it any time
+
+            tempfilename = '%s.%d.tmp' % (filename,
+                    threading.get_native_id())
+            self.create_copy(tempfilename, dstile, tz)
+            os.rename(tempfilename, filename)
+        return filename
+
+    # -------------------------------------------------------------------------
+
+    def shared_uniform_color(self, tilefilename):
+        """Returns the color of a tile file which is a link to a shared uniform tile, otherwise None"""
+
+        try:
+            st = os.lstat(tilefilename)
+        except OSError:
+            return None
+
+        if stat.S_ISLNK(st.st_mode):
+            name = os.path.basename(os.readlink(tilefilename))
+        elif st.st_nlink > 1:
+            if st.st_ino not in self.uniform_inodes:
+
+                # Rescan the shared uniform tiles (other processes may have added some)
+
+                uniformdir = self.uniform_dir()
+                if os.path.isdir(uniformdir):
+                    for name in os.listdir(uniformdir):
+                        if not name.endswith('.tmp'):
+                            ino = os.stat(os.path.join(uniformdir,
+                                    name)).st_ino
+                            self.uniform_inodes[ino] = name
+                self.uniform_inodes.setdefault(st.st_ino, None)
+            name = self.uniform_inodes[st.st_ino]
+        else:
+            return None
+
+        if not name or not name.startswith('uniform-'):
+            return None
+        hexcolor = os.path.splitext(name)[0][len('uniform-'):]
+        return tuple(int(hexcolor[i:i + 2], 16) for i in range(0,
+                     len(hexcolor), 2))
+
+    # -------------------------------------------------------------------------
+
+    def link_tile(self, source, tilefilename):
+        """Make tilefilename a link to the source file (hard link, symbolic link or a copy)"""
+
+        tempfilename = '%s.%d.tmp' % (tilefilename,
+                threading.get_native_id())
+        try:
+            os.link(source, tempfilename)
+        except OSError:
+            try:
+                os.symlink(os.path.relpath(source,
+                           os.path.dirname(tilefilename)), tempfilename)
+            except OSError:
+                shutil.copyfile(source, tempfilename)
+        os.rename(tempfilename, tilefilename)
+
+    # -------------------------------------------------------------------------
+
+    def count(
+        self,
+        tz,
+        name,
+        value=1,
+        ):
+        """Add value to the named per zoom level counter"""
+
+        with self.countlock:
+            zstats = self.tilestats.setdefault(tz, {})
+            zstats[name] = zstats.get(name, 0) + value
+
+    # -------------------------------------------------------------------------
+
+    def count_time(
+        self,
+        tz,
+        name,
+        start,
+        ):
+        """Add the time since start (time.time()) to the named per zoom level timer"""
+
+        self.count(tz, name, time.time() - start)
+
+    # -------------------------------------------------------------------------
+
+    def merge_tilestats(self, tilestats):
+        """Add the counters collected by a worker process"""
+
+        for (tz, zstats) in tilestats.items():
+            for (name, value) in zstats.items():
+                self.count(tz, name, value)
+
+    # -------------------------------------------------------------------------
+
+    def print_tilestats(self):
+        """Print the summary of the per zoom level counters"""
+
+        print('Tiles written (format: tiles / MB / average KB per tile):')
+        total = [0, 0]
+        for tz in range(self.tminz, self.tmaxz + 1):
+            zstats = self.tilestats.get(tz, {})
+            total[0] += zstats.get('written', 0)
+            total[1] += zstats.get('writtenbytes', 0)
+            print ('  zoom %d (%s): %d / %.1f / %.1f' % (tz,
+                   self.tileformats.get(tz, self.tileformat),
+                   zstats.get('written', 0), zstats.get('writtenbytes'
+                   , 0) / 1048576.0, zstats.get('writtenbytes', 0)
+                   / 1024.0 / max(1, zstats.get('written', 0))))
+        print ('  total: %d / %.1f' % (total[0], total[1] / 1048576.0))
+
+        allocated = sum(zstats.get('allocated', 0) for zstats in
+                        self.tilestats.values())
+        reused = sum(zstats.get('reused', 0) for zstats in
+                     self.tilestats.values())
+        print ('Pooled MEM datasets and buffers: %d allocated, %d reuses'
+               % (allocated, reused))
+
+        if self.pngencoder:
+            print('PNG encoding stage (tiles / quantized / MB default / MB encoded / reduction):')
+            for tz in range(self.tminz, self.tmaxz + 1):
+                zstats = self.tilestats.get(tz, {})
+                base = zstats.get('pngbasebytes', 0)
+                print ('  zoom %d: %d / %d / %.1f / %.1f / %.1f%%' % (
+                    tz,
+                    zstats.get('pngtiles', 0),
+                    zstats.get('pngquantized', 0),
+                    base / 1048576.0,
+                    zstats.get('pngbytes', 0) / 1048576.0,
+                    100.0 * (base - zstats.get('pngbytes', 0)) / max(1,
+                            base),
+                    ))
+
+        blockzooms = [tz for tz in range(self.tminz, self.tmaxz + 1)
+                      if self.tilestats.get(tz, {}).get('blockmisses')]
+        if blockzooms:
+            print("Simulated GDAL block cache of the input, traversal '%s' (block hits / misses / hit rate):"
+                   % self.options.traversal)
+            for tz in blockzooms:
+                zstats = self.tilestats[tz]
+                print ('  zoom %d: %d / %d / %.1f%%' % (tz,
+                       zstats.get('blockhits', 0), zstats['blockmisses'
+                       ], 100.0 * zstats.get('blockhits', 0)
+                       / (zstats.get('blockhits', 0)
+                       + zstats['blockmisses'])))
+
+        if self.options.shareuniform:
+            print('Uniform tiles linked to a shared file instead of encoded:')
+            for tz in range(self.tminz, self.tmaxz + 1):
+                print ('  zoom %d: %d' % (tz, self.tilestats.get(tz,
+                       {}).get('uniform', 0)))
+
+        if self.options.dedup or self.options.mbtiles:
+            print('Deduplicated tile store (tiles / unique payloads / MB written / MB stored):')
+            total = dict.fromkeys(('tiles', 'unique', 'bytes',
+                                  'storedbytes'), 0)
+            for tz in range(self.tminz, self.tmaxz + 1):
+                zstats = self.tilestats.get(tz, {})
+                for name in total:
+                    total[name] += zstats.get(name, 0)
+                print ('  zoom %d: %d / %d / %.1f / %.1f' % (tz,
+                       zstats.get('tiles', 0), zstats.get('unique', 0),
+                       zstats.get('bytes', 0) / 1048576.0,
+                       zstats.get('storedbytes', 0) / 1048576.0))
+            print ('  dedup ratio: %.2f (%.1f MB saved)'
+                   % (total['tiles'] / float(max(1, total['unique'])),
+                   (total['bytes'] - total['storedbytes']) / 1048576.0))
+
+    # -------------------------------------------------------------------------
+
+    def write_stats_json(self, walltime):
+        """Write the per zoom level timers and counters to the --stats-json file. The timers are
+        summed over all the processes, with --processes N they can add up to N times the wall time."""
+
+        timers = (('readraster', 'ReadRaster of the input (base tiles)'),
+                  ('scale', 'scale_query_to_tile (resampling)'),
+                  ('write', 'encoding and writing of the tiles (with --writer-threads: copying and queueing)'),
+                  ('writer', 'encoding and writing of the tiles by the --writer-threads'),
+                  ('mkdir', 'creation of the tile directories'),
+                  ('childread', 'reading of the child tiles (overview tiles)'))
+        zooms = {}
+        for tz in range(self.tminz, self.tmaxz + 1):
+            zstats = self.tilestats.get(tz, {})
+            zooms[str(tz)] = {
+                'format': self.tileformats.get(tz, self.tileformat),
+                'tiles': zstats.get('written', 0),
+                'bytes': zstats.get('writtenbytes', 0),
+                'readrasters': zstats.get('readrasters', 0),
+                'scales': zstats.get('scales', 0),
+                'mkdirs': zstats.get('mkdirs', 0),
+                'childreads': zstats.get('childreads', 0),
+                'blockhits': zstats.get('blockhits', 0),
+                'blockmisses': zstats.get('blockmisses', 0),
+                'allocated': zstats.get('allocated', 0),
+                'reused': zstats.get('reused', 0),
+                }
+            for (name, description) in timers:
+                zooms[str(tz)][name + '_s'] = round(zstats.get(name
+                        + 'time', 0.0), 6)
+        stats = {
+            'input': self.input,
+            'output': self.output,
+            'profile': self.options.profile,
+            'resampling': self.options.resampling,
+            'processes': self.options.processes,
+            'depthfirst': self.options.depthfirst,
+            'stripread': self.options.stripread,
+            'traversal': self.options.traversal,
+            'tilesize': self.tilesize,
+            'writerthreads': self.options.writerthreads,
+            'stopped': self.stopped,
+            'wall_s': round(walltime, 3),
+            'timers': dict((name + '_s', description) for (name,
+                           description) in timers),
+            'zooms': zooms,
+            }
+        with open(self.options.statsjson, 'w') as f:
+            json.dump(stats, f, indent=2)
+        print('Timers and counters written to %s'
+              % self.options.statsjson)
+
+    # -------------------------------------------------------------------------
+
+    def read_strip(self, ty, tz):
+        """Read the whole row ty of base tiles with one ReadRaster for the data bands and one
+        for the alpha band, returns numpy arrays (bands, height, width) and (height, width)
+        (None for opaque tiles). Only the last strip is kept in memory."""
+
+        if self.strip and self.strip[:2] == (tz, ty):
+            return self.strip[2:]
+        self.strip = None
+
+        (tminx, tminy, tmaxx, tmaxy) = self.tminmax[tz]
+        tsize = int(self.tsize[tz])
+        xsize = self.out_ds.RasterXSize
+        ysize = self.out_ds.RasterYSize
+
+        # Same extent of the row as for the single tiles in generate_base_tile()
+
+        rysize = 0
+        if ty == tmaxy:
+            rysize = ysize % tsize
+        if rysize == 0:
+            rysize = tsize
+        if self.options.leaflet:
+            ry = ty * tsize
+        else:
+            ry = ysize - ty * tsize - rysize
+
+        rxsize = xsize % tsize or tsize
+        wxsize = (tmaxx - tminx) * self.tilesize + max(1, int(rxsize
+                / float(tsize) * self.tilesize))
+        wysize = max(1, int(rysize / float(tsize) * self.tilesize))
+
+        self.simulate_block_cache(tz, tminx * tsize, ry, xsize - tminx
+                                  * tsize, rysize)
+        start = time.time()
+        data = self.out_ds.ReadRaster(
+            tminx * tsize,
+            ry,
+            xsize - tminx * tsize,
+            rysize,
+            wxsize,
+            wysize,
+            band_list=self.databandlist,
+            )
+        stripalpha = None
+        if not self.opaque:
+            alpha = self.alphaband.ReadRaster(
+                tminx * tsize,
+                ry,
+                xsize - tminx * tsize,
+                rysize,
+                wxsize,
+                wysize,
+                )
+            stripalpha = numpy.frombuffer(alpha,
+                    numpy.uint8).reshape((wysize, wxsize))
+        self.count(tz, 'readrasters')
+        self.count_time(tz, 'readrastertime', start)
+
+        stripdata = numpy.frombuffer(data, numpy.uint8).reshape(
+            (self.dataBandsCount, wysize, wxsize))
+        self.strip = (tz, ty, stripdata, stripalpha)
+        return (stripdata, stripalpha)
 
     # -------------------------------------------------------------------------
 
@@ -1793,13 +3632,11 @@ gdal2tiles temp.vrt"""
 
         print('Generating Overview Tiles:')
 
-        tilebands = self.dataBandsCount + 1
-
         # Usage of existing tiles: from 4 underlying tiles generate one as overview.
 
         tcount = 0
         for tz in range(self.tmaxz - 1, self.tminz - 1, -1):
-            (tminx, tminy, tmaxx, tmaxy) = self.tminmax[tz]
+            (tminx, tminy, tmaxx, tmaxy) = self.tile_range(tz)
             tcount += (1 + abs(tmaxx - tminx)) * (1 + abs(tmaxy
                     - tminy))
 
@@ -1808,134 +3645,328 @@ gdal2tiles temp.vrt"""
         # querysize = tilesize * 2
 
         for tz in range(self.tmaxz - 1, self.tminz - 1, -1):
-            (tminx, tminy, tmaxx, tmaxy) = self.tminmax[tz]
-            yrange = range(tmaxy, tminy - 1, -1)
-            if self.options.leaflet:
-                yrange = range(tminy, tmaxy + 1)
-            for ty in yrange:
-                for tx in range(tminx, tmaxx + 1):
+            (tminx, tminy, tmaxx, tmaxy) = self.tile_range(tz)
+            tiles = self.tile_order(tminx, tminy, tmaxx, tmaxy)
+            self.make_tile_dirs(tz, tminx, tmaxx)
 
-                    if self.stopped:
-                        break
+            if self.pool:
 
-                    ti += 1
-                    tilefilename = os.path.join(self.output, str(tz),
-                            str(tx), '%s.%s' % (ty, self.tileext))
+                # Tiles of one zoom level depend only on the level below:
+                # render the whole level in parallel, then go one level up
 
-                    if self.options.verbose:
-                        print (ti, '/', tcount, tilefilename)  # , "( TileMapService: z / x / y )"
+                jobs = self.tile_jobs(tz, tiles, tmaxx - tminx + 1)
+                ti = self.run_parallel(worker_overview_tiles, jobs,
+                        tcount, ti)
+                if self.stopped:
+                    break
+                continue
 
-                    if self.options.resume \
-                        and os.path.exists(tilefilename):
-                        if self.options.verbose:
-                            print('Tile generation skiped because of --resume')
-                        else:
-                            self.progressbar(ti / float(tcount))
-                        continue
+            for (tx, ty) in tiles:
 
-                    # Create directories for the tile
+                if self.stopped:
+                    break
 
-                    if not os.path.exists(os.path.dirname(tilefilename)):
-                        os.makedirs(os.path.dirname(tilefilename))
+                ti += 1
+                if self.options.verbose:
+                    print (ti, '/', tcount, self.tile_filename(tx, ty,
+                           tz))  # , "( TileMapService: z / x / y )"
 
-                    dsquery = self.mem_drv.Create('', 2
-                            * self.tilesize, 2 * self.tilesize,
-                            tilebands)
+                self.generate_overview_tile(tx, ty, tz)
 
-                    # TODO: fill the null value
-                    # for i in range(1, tilebands+1):
-                    #   dsquery.GetRasterBand(1).Fill(tilenodata)
+                if not self.options.verbose:
+                    self.progressbar(ti / float(tcount))
 
-                    dstile = self.mem_drv.Create('', self.tilesize,
-                            self.tilesize, tilebands)
+            if self.writer:
+                self.writer.flush()
 
-                    # TODO: Implement more clever walking on the tiles with cache functionality
-                    # probably walk should start with reading of four tiles from top left corner
-                    # Hilbert curve
+    # -------------------------------------------------------------------------
 
-                    children = []
+    def generate_overview_tile(
+        self,
+        tx,
+        ty,
+        tz,
+        childtiles=None,
+        ):
+        """Generation of one overview tile from the four underlying tiles, returns the tile dataset.
+        The underlying tiles are taken from childtiles (raster data keyed by (x, y)) when
+        available there, otherwise they are read back from the output directory."""
 
-                    # Read the tiles and write them to query window
+        tilebands = self.tilebands
 
-                    for y in range(2 * ty, 2 * ty + 2):
-                        for x in range(2 * tx, 2 * tx + 2):
-                            (minx, miny, maxx, maxy) = self.tminmax[tz
-                                    + 1]
-                            if x >= minx and x <= maxx and y >= miny \
-                                and y <= maxy:
-                                dsquerytile = \
-                                    gdal.Open(os.path.join(self.output,
-                                        str(tz + 1), str(x), '%s.%s'
-                                        % (y, self.tileext)),
-                                        gdal.GA_ReadOnly)
+        tilefilename = self.tile_filename(tx, ty, tz)
 
-                                if self.options.leaflet:
-                                    if ty:
-                                        tileposy = y % (2 * ty) \
+        if self.options.resume and self.tile_done(tz, tx, ty,
+                tilefilename):
+            if self.options.verbose:
+                print('Tile generation skiped because of --resume')
+            return None
+
+        # Create directories for the tile
+
+        if not self.options.mbtiles:
+            self.make_tile_dir(tz, tx)
+
+        # The query is cleared (children may be missing), the tile is written completely
+
+        dsquery = self.mem_dataset(tz, 'overviewquery', 2
+                                   * self.tilesize, tilebands)
+
+        # TODO: fill the null value
+        # for i in range(1, tilebands+1):
+        #   dsquery.GetRasterBand(1).Fill(tilenodata)
+
+        dstile = self.mem_dataset(tz, 'tile', self.tilesize, tilebands,
+                                  False)
+
+        # TODO: Implement more clever walking on the tiles with cache functionality
+        # probably walk should start with reading of four tiles from top left corner
+        # Hilbert curve
+
+        children = []
+        childcolors = []
+
+        # Read the tiles and write them to query window
+
+        for y in range(2 * ty, 2 * ty + 2):
+            for x in range(2 * tx, 2 * tx + 2):
+                (minx, miny, maxx, maxy) = self.tminmax[tz
+                        + 1]
+                if x >= minx and x <= maxx and y >= miny \
+                    and y <= maxy:
+                    childfilename = self.tile_filename(x, y, tz + 1)
+                    tiledata = None
+                    color = None
+                    if childtiles \
+                        and childtiles.get((x, y)) is not None:
+                        tiledata = childtiles[(x, y)]
+                        if self.options.shareuniform:
+                            color = self.uniform_color(tiledata,
+                                    tilebands)
+                    elif self.options.shareuniform:
+                        color = self.shared_uniform_color(childfilename)
+
+                        # A shared tile of an earlier run with (or without) alpha band
+
+                        if color and len(color) != tilebands:
+                            color = None
+
+                    if color and tiledata is None:
+
+                        # Link to a shared uniform tile, no need to decode it
+
+                        tiledata = b''.join(bytes((c, ))
+                                * self.tilesize * self.tilesize
+                                for c in color)
+                    elif tiledata is None and self.mbtiles:
+
+                        # Decode the child from the MBTiles file in memory
+
+                        start = time.time()
+                        vsifilename = '/vsimem/gdal2tiles-child-%d.%s' \
+                            % (os.getpid(), self.tile_format(tz + 1)[1])
+                        gdal.FileFromMemBuffer(vsifilename,
+                                self.mbtiles.get(tz + 1, x, y))
+                        dsquerytile = gdal.Open(vsifilename,
+                                gdal.GA_ReadOnly)
+                        tiledata = dsquerytile.ReadRaster(0, 0,
+                                self.tilesize, self.tilesize,
+                                band_list=self.tilebandlist)
+                        del dsquerytile
+                        gdal.Unlink(vsifilename)
+                        self.count(tz, 'childreads')
+                        self.count_time(tz, 'childreadtime', start)
+                    elif tiledata is None:
+                        start = time.time()
+                        dsquerytile = gdal.Open(childfilename,
+                                gdal.GA_ReadOnly)
+                        tiledata = dsquerytile.ReadRaster(0, 0,
+                                self.tilesize, self.tilesize,
+                                band_list=self.tilebandlist)
+                        del dsquerytile
+                        self.count(tz, 'childreads')
+                        self.count_time(tz, 'childreadtime', start)
+                    childcolors.append(color)
+
+                    if self.options.leaflet:
+                        if ty:
+                            tileposy = y % (2 * ty) \
     * self.tilesize
-                                    elif ty == 0 and y == 1:
-                                        tileposy = self.tilesize
-                                    else:
-                                        tileposy = 0
-                                else:
-                                    if ty == 0 and y == 1 or ty != 0 \
+                        elif ty == 0 and y == 1:
+                            tileposy = self.tilesize
+                        else:
+                            tileposy = 0
+                    else:
+                        if ty == 0 and y == 1 or ty != 0 \
     and y % (2 * ty) != 0:
-                                        tileposy = 0
-                                    else:
-                                        tileposy = self.tilesize
+                            tileposy = 0
+                        else:
+                            tileposy = self.tilesize
 
-                                if tx:
-                                    tileposx = x % (2 * tx) \
+                    if tx:
+                        tileposx = x % (2 * tx) \
     * self.tilesize
-                                elif tx == 0 and x == 1:
-                                    tileposx = self.tilesize
-                                else:
-                                    tileposx = 0
-                                dsquery.WriteRaster(
-                                    tileposx,
-                                    tileposy,
-                                    self.tilesize,
-                                    self.tilesize,
-                                    dsquerytile.ReadRaster(0, 0,
-        self.tilesize, self.tilesize),
-                                    band_list=list(range(1, tilebands
-        + 1)),
-                                    )
-                                children.append([x, y, tz + 1])
-
-                    self.scale_query_to_tile(dsquery, dstile,
-                            tilefilename)
-
-                    # Write a copy of tile to png/jpg
-
-                    if self.options.resampling != 'antialias':
-
-                        # Write a copy of tile to png/jpg
-
-                        self.out_drv.CreateCopy(tilefilename, dstile,
-                                strict=0)
+                    elif tx == 0 and x == 1:
+                        tileposx = self.tilesize
+                    else:
+                        tileposx = 0
+                    dsquery.WriteRaster(
+                        tileposx,
+                        tileposy,
+                        self.tilesize,
+                        self.tilesize,
+                        tiledata,
+                        band_list=self.tilebandlist,
+                        )
+                    children.append([x, y, tz + 1])
 
-                    if self.options.verbose:
-                        print (
-                            '\tbuild from zoom',
-                            tz + 1,
-                            ' tiles:',
-                            (2 * tx, 2 * ty),
-                            (2 * tx + 1, 2 * ty),
-                            (2 * tx, 2 * ty + 1),
-                            (2 * tx + 1, 2 * ty + 1),
-                            )
+        if len(childcolors) == 4 and childcolors[0] is not None \
+            and childcolors.count(childcolors[0]) == 4:
+
+            # Four identical uniform children give the same uniform tile
+
+            for i in range(tilebands):
+                dstile.GetRasterBand(i + 1).Fill(childcolors[0][i])
+        else:
+            start = time.time()
+            self.scale_query_to_tile(dsquery, dstile,
+                    tilefilename)
+            self.count(tz, 'scales')
+            self.count_time(tz, 'scaletime', start)
+
+        # Write a copy of tile to png/jpg
+
+        start = time.time()
+        self.write_tile(dstile, tilefilename, tx, ty, tz)
+        self.count_time(tz, 'writetime', start)
+
+        if self.options.verbose:
+            print (
+                '\tbuild from zoom',
+                tz + 1,
+                ' tiles:',
+                (2 * tx, 2 * ty),
+                (2 * tx + 1, 2 * ty),
+                (2 * tx, 2 * ty + 1),
+                (2 * tx + 1, 2 * ty + 1),
+                )
+
+        # Create a KML file for this tile.
+
+        if self.kml:
+            f = open(os.path.join(self.output,
+                     '%d/%d/%d.kml' % (tz, tx, ty)), 'w')
+            f.write(self.generate_kml(tx, ty, tz, children))
+            f.close()
+
+        # The writer thread records a queued tile once it is written
+
+        if not self.writer:
+            self.journal.add(tz, tx, ty)
+        return dstile
+
+    # -------------------------------------------------------------------------
+
+    def generate_tiles_depth_first(self):
+        """Generation of the base and overview tiles in a single depth-first walk of the quadtree.
+        Every overview tile is built from its four children while they are still in memory,
+        so at most four tiles per zoom level are held at any time."""
+
+        print('Generating Tiles (depth-first):')
+
+        self.tcount = 0
+        for tz in range(self.tmaxz, self.tminz - 1, -1):
+            (tminx, tminy, tmaxx, tmaxy) = self.tile_range(tz)
+            self.tcount += (1 + abs(tmaxx - tminx)) * (1 + abs(tmaxy
+                    - tminy))
+            self.make_tile_dirs(tz, tminx, tmaxx)
+        self.ti = 0
+
+        # With worker processes the subtrees below the first zoom level
+        # with enough tiles to keep all workers busy are rendered in parallel
+
+        self.depthfirst_split = None
+        self.depthfirst_tiles = {}
+        if self.pool:
+            for tz in range(self.tminz, self.tmaxz + 1):
+                (tminx, tminy, tmaxx, tmaxy) = self.tile_range(tz)
+                if (1 + abs(tmaxx - tminx)) * (1 + abs(tmaxy - tminy)) \
+                    >= 4 * self.options.processes or tz == self.tmaxz:
+                    break
+            self.depthfirst_split = tz
+            (tminx, tminy, tmaxx, tmaxy) = self.tile_range(tz)
+            jobs = [(tz, tx, ty) for ty in range(tminy, tmaxy + 1)
+                    for tx in range(tminx, tmaxx + 1)]
+            for ((tx, ty), tiledata, done, tilestats) in \
+                self.pool.imap_unordered(worker_depth_first, jobs):
+                self.depthfirst_tiles[(tx, ty)] = tiledata
+                self.ti += done
+                self.merge_tilestats(tilestats)
+                if not self.options.verbose:
+                    self.progressbar(self.ti / float(self.tcount))
+                if self.stopped:
+                    return
+
+        (tminx, tminy, tmaxx, tmaxy) = self.tile_range(self.tminz)
+        yrange = range(tmaxy, tminy - 1, -1)
+        if self.options.leaflet:
+            yrange = range(tminy, tmaxy + 1)
+        for ty in yrange:
+            for tx in range(tminx, tmaxx + 1):
+                if self.stopped:
+                    break
+                self.generate_tile_depth_first(tx, ty, self.tminz)
 
-                    # Create a KML file for this tile.
+    # -------------------------------------------------------------------------
 
-                    if self.kml:
-                        f = open(os.path.join(self.output,
-                                 '%d/%d/%d.kml' % (tz, tx, ty)), 'w')
-                        f.write(self.generate_kml(tx, ty, tz, children))
-                        f.close()
+    def generate_tile_depth_first(
+        self,
+        tx,
+        ty,
+        tz,
+        ):
+        """Generation of the tile and of its whole subtree, returns the raster data of the tile
+        (None if the tile was skipped because of --resume)"""
+
+        if tz == self.depthfirst_split:
+            return self.depthfirst_tiles.pop((tx, ty))
+
+        if tz == self.tmaxz:
+            dstile = self.generate_base_tile(tx, ty, tz)
+        else:
+
+            # With --resume an existing overview tile means its subtree is complete
+
+            tilefilename = self.tile_filename(tx, ty, tz)
+            if self.options.resume and self.tile_done(tz, tx, ty,
+                    tilefilename):
+                return None
+
+            # Children outside of the rendered range are read from disk
+
+            childtiles = {}
+            (minx, miny, maxx, maxy) = self.tile_range(tz + 1)
+            for y in range(2 * ty, 2 * ty + 2):
+                for x in range(2 * tx, 2 * tx + 2):
+                    if self.stopped:
+                        return None
+                    if x >= minx and x <= maxx and y >= miny and y \
+                        <= maxy:
+                        childtiles[(x, y)] = \
+                            self.generate_tile_depth_first(x, y, tz
+                                + 1)
+            dstile = self.generate_overview_tile(tx, ty, tz,
+                    childtiles)
+            del childtiles
+
+        self.ti += 1
+        if self.tcount and not self.options.verbose:
+            self.progressbar(self.ti / float(self.tcount))
+
+        if dstile is None:
+            return None
+        return dstile.ReadRaster(0, 0, self.tilesize, self.tilesize)
 
-                    if not self.options.verbose:
-                        self.progressbar(ti / float(tcount))
 
     # -------------------------------------------------------------------------
 
@@ -2021,20 +4052,46 @@ gdal2tiles temp.vrt"""
                                 % (tilefilename, res))
         elif self.options.resampling == 'antialias':
 
-            # Scaling by PIL (Python Imaging Library) - improved Lanczos
+            # Scaling by PIL (Python Imaging Library) - Lanczos
 
-            array = numpy.zeros((querysize, querysize, tilebands),
-                                numpy.uint8)
+            # Every band is read straight into its (strided) plane of the
+            # pixel interleaved buffer, which is reused for all the tiles
+
+            shape = (dsquery.RasterYSize, querysize, tilebands)
+            if self.antialias_array is None \
+                or self.antialias_array.shape != shape:
+                self.antialias_array = numpy.empty(shape, numpy.uint8)
+                self.count(self.tmaxz, 'allocated')
+            else:
+                self.count(self.tmaxz, 'reused')
+            array = self.antialias_array
             for i in range(tilebands):
-                array[:, :, i] = \
-                    gdalarray.BandReadAsArray(dsquery.GetRasterBand(i
-                        + 1), 0, 0, querysize, querysize)
-            im = Image.fromarray(array, 'RGBA')  # Always four bands
-            im1 = im.resize((tilesize, tilesize), Image.ANTIALIAS)
-            if os.path.exists(tilefilename):
-                im0 = Image.open(tilefilename)
-                im1 = Image.composite(im1, im0, im1)
-            im1.save(tilefilename, self.tiledriver)
+                dsquery.GetRasterBand(i + 1).ReadAsArray(0, 0,
+                        querysize, shape[0], buf_obj=array[:, :, i])
+
+            # Pillow resamples RGBA/LA with premultiplied alpha: transparent
+            # pixels do not bleed into the edges of the map, no compositing
+            # with the existing tile file is needed
+
+            mode = (None, 'L', 'LA', 'RGB', 'RGBA')[tilebands]
+            im = Image.frombuffer(mode, (querysize, shape[0]), array,
+                                  'raw', mode, 0, 1)
+            im1 = im.resize((tilesize, tilesize), getattr(Image,
+                            'Resampling', Image).LANCZOS)
+
+            # The tile is encoded from the tile dataset by write_tile()
+
+            dstile.WriteRaster(
+                0,
+                0,
+                tilesize,
+                tilesize,
+                im1.tobytes(),
+                band_list=self.tilebandlist,
+                buf_pixel_space=tilebands,
+                buf_line_space=tilebands * tilesize,
+                buf_band_space=1,
+                )
         else:
 
             # Other algorithms are implemented by gdal.ReprojectImage().
@@ -2914,6 +4971,87 @@ gdal2tiles temp.vrt"""
         return s
 
 
+# =============================================================================
+# =============================================================================
+# =============================================================================
+
+# Worker processes for --processes: every worker opens its own GDAL2Tiles
+# instance (own gdal.Open handle on the input and own MEM/tile drivers)
+
+_worker_gdal2tiles = None
+
+
+def worker_init(arguments):
+    """Initialization of the GDAL2Tiles instance of a worker process"""
+
+    global _worker_gdal2tiles
+    _worker_gdal2tiles = GDAL2Tiles(arguments)
+    _worker_gdal2tiles.open_input()
+    if _worker_gdal2tiles.options.mbtiles:
+        _worker_gdal2tiles.open_mbtiles()
+    _worker_gdal2tiles.open_journal()
+    _worker_gdal2tiles.open_writer()
+
+    # Stop after the current tile, the main process signals the workers
+
+    signal.signal(signal.SIGTERM, _worker_gdal2tiles.signal_stop)
+    signal.signal(signal.SIGINT, _worker_gdal2tiles.signal_stop)
+
+
+def worker_result(done):
+    """Returns number of rendered tiles and the counters collected since the last job,
+    the queued tiles are written, the MBTiles transaction is committed and the journal
+    flushed after every job"""
+
+    if _worker_gdal2tiles.writer:
+        _worker_gdal2tiles.writer.flush()
+    if _worker_gdal2tiles.mbtiles:
+        _worker_gdal2tiles.mbtiles.commit()
+    _worker_gdal2tiles.journal.flush()
+    tilestats = _worker_gdal2tiles.tilestats
+    _worker_gdal2tiles.tilestats = {}
+    return (done, tilestats)
+
+
+def worker_base_tiles(job):
+    """Render a chunk of base tiles in a worker process, returns number of tiles and counters"""
+
+    (tz, tiles) = job
+    done = 0
+    for (tx, ty) in tiles:
+        if _worker_gdal2tiles.stopped:
+            break
+        _worker_gdal2tiles.generate_base_tile(tx, ty, tz)
+        done += 1
+    return worker_result(done)
+
+
+def worker_depth_first(job):
+    """Render a subtree of tiles in a worker process, returns the raster data of its root tile"""
+
+    (tz, tx, ty) = job
+    _worker_gdal2tiles.ti = 0
+    tiledata = None
+    if not _worker_gdal2tiles.stopped:
+        tiledata = _worker_gdal2tiles.generate_tile_depth_first(tx, ty,
+                tz)
+    (done, tilestats) = worker_result(_worker_gdal2tiles.ti)
+    return ((tx, ty), tiledata, done, tilestats)
+
+
+def worker_overview_tiles(job):
+    """Render a chunk of overview tiles in a worker process, returns number of tiles and counters"""
+
+    (tz, tiles) = job
+    done = 0
+    for (tx, ty) in tiles:
+        if _worker_gdal2tiles.stopped:
+            break
+        _worker_gdal2tiles.generate_overview_tile(tx, ty, tz)
+        done += 1
+    return worker_result(done)
+
+
 # =============================================================================
 # =============================================================================
 # =============================================================================
@@ -8,15 +8,21 @@ set -e  # Exit on any error
 echo "🚀 Starting tile generation for Regnum Online Map..."
 echo "Docker environment detected - GDAL is pre-installed"
 
+# Source map: source-map.png, or e.g. SOURCE=source-map.tif / SOURCE=source-map.vrt from assemble-original-map.py
+SOURCE=${SOURCE:-source-map.png}
+
 # Check if source map exists
-if [ ! -f "source-map.png" ]; then
-    echo "❌ Error: source-map.png not found!"
-    echo "Please ensure source-map.png is in the project root directory."
+if [ ! -f "$SOURCE" ]; then
+    echo "❌ Error: $SOURCE not found!"
+    echo "Please ensure $SOURCE is in the project root directory."
     exit 1
 fi
 
+# Tiling engine: gdal2tiles.py (ENGINE=gdal, default) or the GDAL-free raster2tiles.py (ENGINE=numpy)
+ENGINE=${ENGINE:-gdal}
+
 # Get the gdal2tiles.py tool if not present
-if [ ! -f "gdal2tiles.py" ]; then
+if [ "$ENGINE" = "gdal" ] && [ ! -f "gdal2tiles.py" ]; then
     echo "📥 Downloading gdal2tiles.py..."
     curl -L https://raw.githubusercontent.com/Joshua2504/gdal2tiles-leaflet/master/gdal2tiles.py \
          -o gdal2tiles.py
@@ -35,11 +41,85 @@ chmod 755 tiles
 export GDAL_ALLOW_LARGE_LIBJPEG_MEM_ALLOC=1
 export GDAL_CACHEMAX=512
 
-echo "🔧 Processing source-map.png..."
-echo "📊 Generating tiles for zoom levels 0-9 (10 total levels)..."
+# Number of rendering processes (defaults to all available cores)
+PROCESSES=${PROCESSES:-$(nproc)}
+
+echo "🔧 Processing $SOURCE..."
+echo "📊 Generating tiles for zoom levels 0-9 (10 total levels) with $PROCESSES processes..."
+
+# Optional incremental update of a changed map area ("x,y,width,height" in game coordinates)
+UPDATE_ARGS=()
+if [ -n "$UPDATE_REGION" ]; then
+    echo "♻️  Updating only the tiles of region $UPDATE_REGION (game coordinates)..."
+    UPDATE_ARGS=(--update-region "$UPDATE_REGION" --update-region-units game)
+fi
+
+# Continue an interrupted run (RESUME=1) from the journal in tiles/.journal
+if [ -n "$RESUME" ]; then
+    echo "⏯️  Resuming the interrupted tile generation..."
+    UPDATE_ARGS+=(--resume)
+fi
+
+# Tile format, optionally per zoom level (e.g. FORMAT="webp,8-9:jpeg"), and quality of lossy formats
+FORMAT=${FORMAT:-png}
+QUALITY=${QUALITY:-85}
+UPDATE_ARGS+=(--format "$FORMAT" --quality "$QUALITY")
+
+# Optional PNG encoding stage: palette quantization up to an RMSE (e.g. PNG_QUANTIZE=2.0) and optimize pass (PNG_OPTIMIZE=1)
+if [ -n "$PNG_QUANTIZE" ]; then
+    UPDATE_ARGS+=(--png-quantize "$PNG_QUANTIZE")
+fi
+if [ -n "$PNG_OPTIMIZE" ]; then
+    UPDATE_ARGS+=(--png-optimize)
+fi
+
+# Optional opaque RGB tiles without alpha band (OPAQUE=auto|yes, the source map is fully opaque)
+if [ -n "$OPAQUE" ]; then
+    UPDATE_ARGS+=(--opaque "$OPAQUE")
+fi
+
+# Optional background writer threads per rendering process (WRITER_THREADS=2), overlapping tile encoding and disk writes with the rendering
+if [ -n "$WRITER_THREADS" ]; then
+    UPDATE_ARGS+=(--writer-threads "$WRITER_THREADS")
+fi
+
+# Optional tile size (TILE_SIZE=512: the detail of zoom levels 1-9 of 256px tiles in zoom levels 0-8,
+# a quarter of the files) and high-DPI {y}@2x.png tiles next to the normal ones (RETINA=1)
+if [ -n "$TILE_SIZE" ]; then
+    UPDATE_ARGS+=(--tilesize "$TILE_SIZE")
+    if [ "$TILE_SIZE" = "512" ]; then
+        ZOOM=${ZOOM:-0-8}
+    fi
+fi
+if [ -n "$RETINA" ]; then
+    echo "🔍 Writing high-DPI @2x tiles..."
+    UPDATE_ARGS+=(--retina)
+fi
+ZOOM=${ZOOM:-0-9}
+
+# Optional single-file output: tiles/$MBTILES (MBTiles/SQLite) instead of the tiles/{z}/{x}/{y}.png tree
+if [ -n "$MBTILES" ]; then
+    echo "🗄️  Writing the tiles into tiles/$MBTILES..."
+    UPDATE_ARGS+=(--mbtiles "tiles/$MBTILES")
+fi
+
+if [ "$ENGINE" = "numpy" ]; then
+    if [ -n "$UPDATE_REGION$MBTILES$PNG_QUANTIZE$PNG_OPTIMIZE$OPAQUE$WRITER_THREADS$TILE_SIZE$RETINA" ]; then
+        echo "❌ UPDATE_REGION, MBTILES, PNG_QUANTIZE/PNG_OPTIMIZE, OPAQUE, WRITER_THREADS, TILE_SIZE and RETINA need ENGINE=gdal"
+        exit 1
+    fi
+    echo "🧮 Using the GDAL-free NumPy/Pillow engine (raster2tiles.py)"
+    TILER=./raster2tiles.py
+else
+    TILER=./gdal2tiles.py
+fi
 
 # Generate tiles with optimized settings for Docker
-python3 ./gdal2tiles.py -l -p raster -z 0-9 -w none source-map.png tiles
+# (in the background, so that "docker stop" / Ctrl+C reach the tiler and it can stop cleanly)
+python3 "$TILER" -l -p raster -z "$ZOOM" -w none --processes "$PROCESSES" "${UPDATE_ARGS[@]}" "$SOURCE" tiles &
+TILER_PID=$!
+trap 'kill -TERM "$TILER_PID" 2>/dev/null' TERM INT
+wait "$TILER_PID" || wait "$TILER_PID"
 
 if [ $? -eq 0 ]; then
     echo "✅ Tile generation completed successfully!"
@@ -47,7 +127,11 @@ if [ $? -eq 0 ]; then
     echo "🌐 You can now open 'index.html' in your browser to view the map"
     
     # Count generated tiles for verification
-    TILE_COUNT=$(find tiles -name "*.png" | wc -l)
+    if [ -n "$MBTILES" ]; then
+        TILE_COUNT=$(python3 -c "import sqlite3, sys; print(sqlite3.connect(sys.argv[1]).execute('SELECT COUNT(*) FROM map').fetchone()[0])" "tiles/$MBTILES")
+    else
+        TILE_COUNT=$(find tiles -path tiles/_shared -prune -o \( -name "*.png" -o -name "*.jpg" -o -name "*.webp" \) -print | wc -l)
+    fi
     echo "📈 Generated $TILE_COUNT tile files"
 else
     echo "❌ Tile generation failed!"
@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+"""
+GDAL-free tile engine for the 'raster' profile
+Cuts a plain image (PNG, JPEG, TIFF, ... anything Pillow reads) into the
+same {z}/{x}/{y} tile pyramid as `gdal2tiles.py -p raster` with NumPy and
+Pillow only:
+
+- Base tiles (max zoom) are sliced from the raster with the same tile
+  bounds and edge handling as the 'raster' branch of gdal2tiles.py: the
+  last column/row of tiles is partial and padded with transparent pixels,
+  zoom levels above the native zoom are upscaled by nearest neighbour.
+- Overview tiles are built from their four children by a 2x2 average
+  ('average'), the top-left pixel ('near') or Pillow's Lanczos ('antialias').
+
+The decoded raster is kept in a memory mapped .npy file in the output
+directory, so the worker processes of --processes share it through the page
+cache and there is no GDAL block cache to contend for.
+
+Accepts the gdal2tiles.py options used by generate-tiles.sh, e.g.:
+    python3 raster2tiles.py -l -p raster -z 0-9 -w none --processes 8 source-map.png tiles
+"""
+
+import os
+import sys
+import math
+import signal
+import multiprocessing
+from optparse import OptionParser
+
+import numpy
+from PIL import Image
+
+# The source map is far over Pillow's decompression bomb limit
+Image.MAX_IMAGE_PIXELS = None
+
+RESAMPLING_LIST = ('average', 'near', 'antialias')
+
+# Tile formats: Pillow format, file extension and save options ('quality' is filled in)
+FORMAT_LIST = ('png', 'jpeg', 'webp', 'webp-lossless')
+FORMAT_SAVE = {
+    'png': ('PNG', 'png', {}),
+    'jpeg': ('JPEG', 'jpg', {'quality': None}),
+    'webp': ('WEBP', 'webp', {'quality': None}),
+    'webp-lossless': ('WEBP', 'webp', {'lossless': True}),
+}
+
+
+class Raster2Tiles(object):
+    """Tile pyramid of a raster image for the 'raster' profile"""
+
+    def __init__(self, arguments):
+        """Parse the arguments (same meaning as in gdal2tiles.py)"""
+
+        self.stopped = False
+        self.arguments = arguments
+        self.pool = None
+        self.raster = None
+        self.rasterfile = None
+        self.tilesize = 256
+
+        self.optparse_init()
+        (self.options, self.args) = self.parser.parse_args(args=arguments)
+        if self.options.rastersize:
+            if len(self.args) != 1:
+                self.error('Specify only the output directory with --raster-size.')
+            (self.input, self.output) = (None, self.args[0])
+            try:
+                self.rastersize = tuple(int(v) for v in
+                                        self.options.rastersize.split('x'))
+            except ValueError:
+                self.rastersize = ()
+            if len(self.rastersize) != 2:
+                self.error(f"Invalid --raster-size '{self.options.rastersize}'.",
+                           "Use the format 'WIDTHxHEIGHT'.")
+        elif len(self.args) != 2:
+            self.error('Specify the input file and the output directory.')
+        else:
+            (self.input, self.output) = self.args
+
+        if self.options.profile != 'raster':
+            self.error("Only the 'raster' profile is supported, use gdal2tiles.py for the others.")
+
+        # User specified zoom levels
+
+        self.tminz = None
+        self.tmaxz = None
+        if self.options.zoom:
+            minmax = self.options.zoom.split('-', 1)
+            minmax.extend([''])
+            (zmin, zmax) = minmax[:2]
+            self.tminz = int(zmin)
+            self.tmaxz = int(zmax) if zmax else int(zmin)
+
+        # Tile format of every zoom level: 'FORMAT[,ZOOMS:FORMAT...]'
+
+        self.tileformats = {}
+        specs = self.options.format.split(',')
+        self.tileformat = specs[0]
+        for spec in specs[1:]:
+            try:
+                (zooms, tileformat) = spec.split(':')
+                zooms = zooms.split('-', 1)
+                for z in range(int(zooms[0]), int(zooms[-1]) + 1):
+                    self.tileformats[z] = tileformat
+            except ValueError:
+                self.error(f"Invalid --format '{self.options.format}'.",
+                           "Use the format 'FORMAT[,ZOOMS:FORMAT...]', e.g. 'webp,8-9:jpeg'.")
+        for tileformat in [self.tileformat] + list(self.tileformats.values()):
+            if tileformat not in FORMAT_LIST:
+                self.error(f"Unknown tile format '{tileformat}'.",
+                           f"Use one of {', '.join(FORMAT_LIST)}.")
+
+    # -------------------------------------------------------------------------
+
+    def optparse_init(self):
+        """Prepare the option parser for input (argv)"""
+
+        usage = 'Usage: %prog [options] input_file output_dir'
+        p = OptionParser(usage)
+        p.add_option('-p', '--profile', dest='profile', choices=('raster', ),
+                     help="Tile cutting profile, only 'raster' (default)")
+        p.add_option('-r', '--resampling', dest='resampling',
+                     choices=RESAMPLING_LIST,
+                     help=f"Resampling method of the overview tiles ({','.join(RESAMPLING_LIST)}) - default 'average'")
+        p.add_option('-z', '--zoom', dest='zoom',
+                     help="Zoom levels to render (format:'2-5' or '10').")
+        p.add_option('-e', '--resume', dest='resume', action='store_true',
+                     help='Resume mode. Generate only missing files.')
+        p.add_option('-l', '--leaflet', dest='leaflet', action='store_true',
+                     help='Set 0,0 point to north. For use with Leaflet. Requires -p raster.')
+        p.add_option('-w', '--webviewer', dest='webviewer',
+                     help='Ignored, no web viewer is generated')
+        p.add_option('-v', '--verbose', dest='verbose', action='store_true',
+                     help='Print status messages to stdout')
+        p.add_option('--processes', dest='processes', type='int',
+                     help='Number of processes rendering the tiles (default 1)')
+        p.add_option('--format', dest='format',
+                     metavar='FORMAT[,ZOOMS:FORMAT...]',
+                     help=f"Tile format ({','.join(FORMAT_LIST)}), optionally different for some zoom levels (default 'png')")
+        p.add_option('--quality', dest='quality', type='int',
+                     help='Quality of the lossy JPEG and WebP tiles, 1-100 (default 85)')
+        p.add_option('--raster-size', dest='rastersize', metavar='WIDTHxHEIGHT',
+                     help='The base tiles of a raster of this size are already in the output directory, generate only the overview tiles (no input file)')
+        p.set_defaults(profile='raster', resampling='average', resume=False,
+                       leaflet=False, verbose=False, processes=1,
+                       format='png', quality=85)
+        self.parser = p
+
+    # -------------------------------------------------------------------------
+
+    def error(self, msg, details=''):
+        """Print an error message and stop the processing"""
+
+        if details:
+            self.parser.error(msg + '\n\n' + details)
+        else:
+            self.parser.error(msg)
+
+    # -------------------------------------------------------------------------
+
+    def progressbar(self, complete=0.0):
+        """Print progressbar for float value 0..1 (the same as gdal.TermProgress)"""
+
+        step = int(complete * 40)
+        last = getattr(self, 'progressstep', -1)
+        if step <= last:
+            return
+        for i in range(last + 1, step + 1):
+            if i % 4 == 0:
+                sys.stdout.write(str(i // 4 * 10))
+                if i == 40:
+                    sys.stdout.write(' - done.\n')
+            else:
+                sys.stdout.write('.')
+        sys.stdout.flush()
+        self.progressstep = step if step < 40 else -1
+
+    # -------------------------------------------------------------------------
+
+    def stop(self, signum=None, frame=None):
+        """Stop the rendering after the current tile (signal handler as well)"""
+
+        self.stopped = True
+        if self.pool:
+            for p in multiprocessing.active_children():
+                os.kill(p.pid, signal.SIGTERM)
+
+    # -------------------------------------------------------------------------
+
+    def process(self):
+        """The main processing function, runs all the main steps of processing"""
+
+        os.makedirs(self.output, exist_ok=True)
+        if not self.options.rastersize:
+            self.prepare_input()
+        self.open_input()
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        if self.options.processes > 1:
+            self.pool = multiprocessing.get_context('spawn').Pool(
+                self.options.processes, worker_init, (self.arguments, ))
+        try:
+            if not self.options.rastersize:
+                self.generate_base_tiles()
+            self.generate_overview_tiles()
+        finally:
+            if self.pool:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+            self.raster = None
+            if self.rasterfile:
+                os.unlink(self.rasterfile)
+
+        if self.stopped:
+            print('Stopped, continue the rendering with --resume')
+
+    # -------------------------------------------------------------------------
+
+    def raster_filename(self):
+        """Returns the file name of the decoded raster shared by the processes"""
+
+        return os.path.join(self.output, '.raster2tiles.npy')
+
+    # -------------------------------------------------------------------------
+
+    def prepare_input(self):
+        """Decode the input image into the memory mapped raster file (height, width, bands)"""
+
+        print(f'Decoding {self.input}...')
+        im = Image.open(self.input)
+        if im.mode not in ('RGB', 'RGBA'):
+            im = im.convert('RGBA' if 'A' in im.getbands()
+                            or 'transparency' in im.info else 'RGB')
+        im.load()
+        (width, height) = im.size
+        raster = numpy.lib.format.open_memmap(
+            self.raster_filename(), mode='w+', dtype=numpy.uint8,
+            shape=(height, width, len(im.getbands())))
+
+        # Copy in strips, converting the whole image at once would double the memory use
+
+        for y in range(0, height, 1024):
+            strip = im.crop((0, y, width, min(height, y + 1024)))
+            raster[y:y + strip.size[1]] = numpy.asarray(strip)
+        raster.flush()
+        del raster
+        del im
+
+    # -------------------------------------------------------------------------
+
+    def open_input(self):
+        """Open the decoded raster and compute the tile ranges of all the zoom levels"""
+
+        if self.options.rastersize:
+            (xsize, ysize) = self.rastersize
+            self.bands = 3
+        else:
+            self.rasterfile = self.raster_filename()
+            self.raster = numpy.load(self.rasterfile, mmap_mode='r')
+            (ysize, xsize, self.bands) = self.raster.shape
+        (self.xsize, self.ysize) = (xsize, ysize)
+
+        log2 = lambda x: math.log10(x) / math.log10(2)  # log2 (base 2 logarithm), as in gdal2tiles.py
+
+        self.nativezoom = int(max(math.ceil(log2(xsize / float(self.tilesize))),
+                                  math.ceil(log2(ysize / float(self.tilesize)))))
+        if int(self.tmaxz or 0) < self.nativezoom:
+            self.tmaxz = self.nativezoom
+        if self.tminz is None:
+            self.tminz = 0
+
+        # Table with min max tile coordinates and the tile size in raster pixels for all zoom levels
+
+        self.tminmax = list(range(0, self.tmaxz + 1))
+        self.tsize = list(range(0, self.tmaxz + 1))
+        for tz in range(0, self.tmaxz + 1):
+            tsize = 2.0 ** (self.nativezoom - tz) * self.tilesize
+            tmaxx = int(math.ceil(xsize / tsize)) - 1
+            tmaxy = int(math.ceil(ysize / tsize)) - 1
+            self.tsize[tz] = int(math.ceil(tsize))
+            self.tminmax[tz] = (0, 0, tmaxx, tmaxy)
+
+        if self.options.verbose:
+            print('Input raster:', xsize, 'x', ysize, 'bands:', self.bands)
+            print('Native zoom of the raster:', self.nativezoom)
+
+    # -------------------------------------------------------------------------
+
+    def run_parallel(self, worker, jobs, tcount, ti=0):
+        """Distribute the tile jobs over the worker pool and merge their progress into one progressbar"""
+
+        for done in self.pool.imap_unordered(worker, jobs):
+            ti += done
+            if not self.options.verbose:
+                self.progressbar(ti / float(tcount))
+            if self.stopped:
+                break
+        return ti
+
+    # -------------------------------------------------------------------------
+
+    def run_serial(self, generate, tz, tcount, ti=0):
+        """Render all the tiles of the zoom level in this process"""
+
+        (tminx, tminy, tmaxx, tmaxy) = self.tminmax[tz]
+        for ty in self.yrange(tz):
+            for tx in range(tminx, tmaxx + 1):
+                if self.stopped:
+                    return ti
+                generate(tx, ty, tz)
+                ti += 1
+                if not self.options.verbose:
+                    self.progressbar(ti / float(tcount))
+        return ti
+
+    # -------------------------------------------------------------------------
+
+    def yrange(self, tz):
+        """Rows of tiles of the zoom level in the order of gdal2tiles.py"""
+
+        (tminx, tminy, tmaxx, tmaxy) = self.tminmax[tz]
+        if self.options.leaflet:
+            return range(tminy, tmaxy + 1)
+        return range(tmaxy, tminy - 1, -1)
+
+    # -------------------------------------------------------------------------
+
+    def tile_count(self, tz):
+        """Returns the number of tiles of the zoom level"""
+
+        (tminx, tminy, tmaxx, tmaxy) = self.tminmax[tz]
+        return (1 + tmaxx - tminx) * (1 + tmaxy - tminy)
+
+    # -------------------------------------------------------------------------
+
+    def generate_level(self, worker, generate, tz, tcount, ti=0):
+        """Render all the tiles of the zoom level, one job per row of tiles with --processes"""
+
+        (tminx, tminy, tmaxx, tmaxy) = self.tminmax[tz]
+        if self.pool:
+            jobs = [(tz, [(tx, ty) for tx in range(tminx, tmaxx + 1)])
+                    for ty in self.yrange(tz)]
+            return self.run_parallel(worker, jobs, tcount, ti)
+        return self.run_serial(generate, tz, tcount, ti)
+
+    # -------------------------------------------------------------------------
+
+    def generate_base_tiles(self):
+        """Generation of the base tiles (the lowest in the pyramid) directly from the raster"""
+
+        print('Generating Base Tiles:')
+        self.generate_level(worker_base_tiles, self.generate_base_tile,
+                            self.tmaxz, self.tile_count(self.tmaxz))
+
+    # -------------------------------------------------------------------------
+
+    def generate_overview_tiles(self):
+        """Generation of the overview tiles (higher in the pyramid) from the tiles below,
+        a zoom level is finished completely before the next coarser level starts"""
+
+        print('Generating Overview Tiles:')
+        tcount = sum(self.tile_count(tz)
+                     for tz in range(self.tminz, self.tmaxz))
+        ti = 0
+        for tz in range(self.tmaxz - 1, self.tminz - 1, -1):
+            if self.stopped:
+                return
+            ti = self.generate_level(worker_overview_tiles,
+                                     self.generate_overview_tile, tz,
+                                     tcount, ti)
+
+    # -------------------------------------------------------------------------
+
+    def generate_base_tile(self, tx, ty, tz):
+        """Slice one base tile out of the raster (same bounds as the 'raster' branch of gdal2tiles.py)"""
+
+        tilefilename = self.tile_filename(tx, ty, tz)
+        if self.options.resume and os.path.exists(tilefilename):
+            return
+
+        (tminx, tminy, tmaxx, tmaxy) = self.tminmax[tz]
+        tsize = self.tsize[tz]  # tilesize in raster coordinates for actual zoom
+
+        rx = tx * tsize
+        rxsize = 0
+        if tx == tmaxx:
+            rxsize = self.xsize % tsize
+        if rxsize == 0:
+            rxsize = tsize
+
+        rysize = 0
+        if ty == tmaxy:
+            rysize = self.ysize % tsize
+        if rysize == 0:
+            rysize = tsize
+        if self.options.leaflet:
+            ry = ty * tsize
+        else:
+            ry = self.ysize - ty * tsize - rysize
+
+        (wx, wy) = (0, 0)
+        (wxsize, wysize) = (int(rxsize / float(tsize) * self.tilesize),
+                            int(rysize / float(tsize) * self.tilesize))
+        if not self.options.leaflet and wysize != self.tilesize:
+            wy = self.tilesize - wysize
+
+        region = self.raster[ry:ry + rysize, rx:rx + rxsize]
+        if tz >= self.nativezoom:
+
+            # Nearest neighbour, the pixel centers as in GDAL's RasterIO
+
+            yi = ((numpy.arange(wysize) + 0.5) * rysize / wysize).astype(numpy.intp)
+            xi = ((numpy.arange(wxsize) + 0.5) * rxsize / wxsize).astype(numpy.intp)
+            data = region[yi[:, None], xi[None, :]]
+        else:
+            im = Image.fromarray(numpy.ascontiguousarray(region))
+            data = numpy.asarray(im.resize((wxsize, wysize), Image.BOX))
+
+        tile = numpy.zeros((self.tilesize, self.tilesize, 4), numpy.uint8)
+        tile[wy:wy + wysize, wx:wx + wxsize, :self.bands] = data
+        if self.bands == 3:
+            tile[wy:wy + wysize, wx:wx + wxsize, 3] = 255
+
+        self.write_tile(tile, tilefilename, tz)
+
+    # -------------------------------------------------------------------------
+
+    def generate_overview_tile(self, tx, ty, tz):
+        """Generation of one overview tile from the four underlying tiles"""
+
+        tilefilename = self.tile_filename(tx, ty, tz)
+        if self.options.resume and os.path.exists(tilefilename):
+            return
+
+        ts = self.tilesize
+        query = numpy.zeros((2 * ts, 2 * ts, 4), numpy.uint8)
+        (minx, miny, maxx, maxy) = self.tminmax[tz + 1]
+        for y in range(2 * ty, 2 * ty + 2):
+            for x in range(2 * tx, 2 * tx + 2):
+                if x < minx or x > maxx or y < miny or y > maxy:
+                    continue
+                im = Image.open(self.tile_filename(x, y, tz + 1))
+                tileposx = (x - 2 * tx) * ts
+                if self.options.leaflet:
+                    tileposy = (y - 2 * ty) * ts
+                else:
+                    tileposy = (2 * ty + 1 - y) * ts
+                query[tileposy:tileposy + ts, tileposx:tileposx + ts] = \
+                    numpy.asarray(im.convert('RGBA'))
+
+        if self.options.resampling == 'near':
+            tile = numpy.ascontiguousarray(query[1::2, 1::2])
+        elif self.options.resampling == 'antialias':
+            im = Image.fromarray(query, 'RGBA')
+            tile = numpy.asarray(im.resize((ts, ts), Image.LANCZOS))
+        else:
+            tile = ((query.reshape(ts, 2, ts, 2, 4).sum(axis=(1, 3),
+                    dtype=numpy.uint16) + 2) // 4).astype(numpy.uint8)
+
+        self.write_tile(tile, tilefilename, tz)
+
+    # -------------------------------------------------------------------------
+
+    def tile_filename(self, tx, ty, tz):
+        """Returns the file name of the tile in the output directory"""
+
+        ext = FORMAT_SAVE[self.tileformats.get(tz, self.tileformat)][1]
+        return os.path.join(self.output, str(tz), str(tx), f'{ty}.{ext}')
+
+    # -------------------------------------------------------------------------
+
+    def write_tile(self, tile, tilefilename, tz):
+        """Encode the RGBA tile array into the tile file (temporary file renamed into place)"""
+
+        (fmt, ext, params) = FORMAT_SAVE[self.tileformats.get(tz, self.tileformat)]
+        params = dict((k, self.options.quality if v is None else v)
+                      for (k, v) in params.items())
+        im = Image.fromarray(tile, 'RGBA')
+        if fmt == 'JPEG':
+            im = im.convert('RGB')  # JPEG has no alpha channel
+
+        os.makedirs(os.path.dirname(tilefilename), exist_ok=True)
+        tempfilename = f'{tilefilename}.{os.getpid()}.tmp'
+        im.save(tempfilename, fmt, **params)
+        os.rename(tempfilename, tilefilename)
+        if self.options.verbose:
+            print(tilefilename)
+
+
+# =============================================================================
+
+_worker_raster2tiles = None
+
+
+def worker_init(arguments):
+    """Initialization of the Raster2Tiles instance of a worker process"""
+
+    global _worker_raster2tiles
+    _worker_raster2tiles = Raster2Tiles(arguments)
+    _worker_raster2tiles.open_input()
+    signal.signal(signal.SIGTERM, _worker_raster2tiles.stop)
+    signal.signal(signal.SIGINT, _worker_raster2tiles.stop)
+
+
+def worker_tiles(generate, job):
+    """Render a chunk of tiles in a worker process, returns number of tiles"""
+
+    (tz, tiles) = job
+    done = 0
+    for (tx, ty) in tiles:
+        if _worker_raster2tiles.stopped:
+            break
+        generate(tx, ty, tz)
+        done += 1
+    return done
+
+
+def worker_base_tiles(job):
+    """Render a row of base tiles in a worker process"""
+
+    return worker_tiles(_worker_raster2tiles.generate_base_tile, job)
+
+
+def worker_overview_tiles(job):
+    """Render a row of overview tiles in a worker process"""
+
+    return worker_tiles(_worker_raster2tiles.generate_overview_tile, job)
+
+
+if __name__ == '__main__':
+    Raster2Tiles(sys.argv[1:]).process()
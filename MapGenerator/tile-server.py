@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+On-demand tile server for the Regnum map
+Renders /tiles/{z}/{x}/{y}.png lazily from the source map on the first
+request instead of pre-rendering every tile of zoom levels 0-9:
+
+- Every tile is rendered directly from the source raster by the worker
+  processes of gdal2tiles.py (worker_init / worker_base_tiles, the tile
+  window math of generate_base_tiles()), so a tile is identical to the one
+  of `gdal2tiles.py -l -p raster -z Z` for its zoom level Z.
+- Rendered tiles are written to the disk cache, a normal {z}/{x}/{y} tile
+  tree (a pre-rendered tree can be used as the cache), and kept in a size
+  bounded in-memory LRU cache.
+- Concurrent requests for the same tile wait for one render.
+
+    python3 tile-server.py --port 8090 --cache-dir tiles source-map.tif
+
+Low zoom tiles cover a large window of the source, use a tiled GeoTIFF with
+overviews (assemble-original-map.py --output-format gtiff) rather than the
+PNG. Delete the cache directory when the source map changes.
+"""
+
+import os
+import re
+import sys
+import json
+import asyncio
+import argparse
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import gdal2tiles
+
+TILE_PATH = re.compile(r"^/tiles/(\d+)/(\d+)/(\d+)(@2x)?\.(\w+)$")
+CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "webp": "image/webp"}
+STATUS_TEXT = {200: "OK", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+class LRUCache:
+    """Encoded tiles in memory up to a total size, the least recently used are evicted first"""
+
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.size = 0
+        self.tiles = OrderedDict()
+
+    def get(self, key):
+        """The tile data or None"""
+        data = self.tiles.get(key)
+        if data is not None:
+            self.tiles.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        """Add a tile, evict the oldest tiles over the size limit"""
+        if len(data) > self.maxbytes:
+            return
+        old = self.tiles.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self.tiles[key] = data
+        self.size += len(data)
+        while self.size > self.maxbytes:
+            key, old = self.tiles.popitem(last=False)
+            self.size -= len(old)
+
+def read_file(filename):
+    """Contents of the file or None if it does not exist"""
+    try:
+        with open(filename, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+class TileServer:
+    """HTTP server rendering the tiles on demand"""
+
+    def __init__(self, args):
+        # The same tiler options as generate-tiles.sh, the cache directory is the output directory
+        self.arguments = ["-l", "-p", "raster", "-w", "none", "-z", args.zoom,
+                          "-r", args.resampling, "--format", args.format,
+                          "--quality", str(args.quality), "--tilesize", str(args.tilesize)]
+        if args.retina:
+            self.arguments.append("--retina")
+        self.arguments += [args.source, args.cache_dir]
+        os.makedirs(args.cache_dir, exist_ok=True)
+        self.tiler = gdal2tiles.GDAL2Tiles(self.arguments)
+        self.tiler.open_input()
+        self.processes = args.processes
+        self.pool = None
+        self.cache = LRUCache(args.cache_mb * 1024 * 1024)
+        self.rendering = {}  # (z, x, y) -> task loading or rendering the tile
+        self.stats = dict.fromkeys(("requests", "memory", "disk", "rendered", "coalesced", "notfound", "errors"), 0)
+
+    def start_pool(self):
+        """Worker processes, each with its own GDAL2Tiles instance on the source"""
+        self.pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=gdal2tiles.worker_init, initargs=(self.arguments,))
+
+    def tile_exists(self, z, x, y, suffix, ext):
+        """Is the tile inside the map and requested with the suffix and extension of its format?"""
+        if z < self.tiler.tminz or z > self.tiler.tmaxz or suffix != self.tiler.tilesuffix:
+            return False
+        (tminx, tminy, tmaxx, tmaxy) = self.tiler.tminmax[z]
+        return tminx <= x <= tmaxx and tminy <= y <= tmaxy and ext == self.tiler.tile_format(z)[1]
+
+    async def tile(self, z, x, y):
+        """Encoded tile from the memory cache, the disk cache or rendered"""
+        key = (z, x, y)
+        data = self.cache.get(key)
+        if data is not None:
+            self.stats["memory"] += 1
+            return data
+
+        # Join the render of the tile in progress
+        task = self.rendering.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(self.load(key))
+            self.rendering[key] = task
+            task.add_done_callback(lambda task: self.rendering.pop(key, None))
+
+        # A closed connection does not cancel the render other requests are waiting for
+        return await asyncio.shield(task)
+
+    async def load(self, key):
+        """Read the tile from the disk cache, render it first if it is not there"""
+        (z, x, y) = key
+        filename = self.tiler.tile_filename(x, y, z)
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, read_file, filename)
+        if data is None:
+            (done, tilestats) = await loop.run_in_executor(self.pool, gdal2tiles.worker_base_tiles, (z, [(x, y)]))
+            self.tiler.merge_tilestats(tilestats)
+            data = await loop.run_in_executor(None, read_file, filename)
+            if data is None:
+                raise IOError(f"tile {z}/{x}/{y} was not written")
+            self.stats["rendered"] += 1
+        else:
+            self.stats["disk"] += 1
+        self.cache.put(key, data)
+        return data
+
+    async def respond(self, method, path):
+        """Returns status, content type and body of the response"""
+        if method not in ("GET", "HEAD"):
+            return 405, "text/plain", b"Method not allowed\n"
+        if path == "/stats":
+            stats = dict(self.stats, cachedtiles=len(self.cache.tiles), cachedbytes=self.cache.size,
+                         rendering=len(self.rendering))
+            return 200, "application/json", json.dumps(stats).encode() + b"\n"
+
+        match = TILE_PATH.match(path)
+        if not match:
+            return 404, "text/plain", b"Not found\n"
+        (z, x, y) = (int(v) for v in match.groups()[:3])
+        (suffix, ext) = (match.group(4) or "", match.group(5))
+        self.stats["requests"] += 1
+        if not self.tile_exists(z, x, y, suffix, ext):
+            self.stats["notfound"] += 1
+            return 404, "text/plain", b"No such tile\n"
+        try:
+            data = await self.tile(z, x, y)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Error rendering tile {z}/{x}/{y}: {e}", file=sys.stderr)
+            return 500, "text/plain", b"Rendering failed\n"
+        return 200, CONTENT_TYPES.get(ext, "application/octet-stream"), data
+
+    async def handle(self, reader, writer):
+        """One HTTP/1.1 connection (keep-alive)"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                (method, target, version) = (lines[0].split(" ") + ["", ""])[:3]
+                headers = {}
+                for line in lines[1:]:
+                    (name, sep, value) = line.partition(":")
+                    if sep:
+                        headers[name.strip().lower()] = value.strip().lower()
+                keepalive = version == "HTTP/1.1" and headers.get("connection") != "close"
+
+                (status, content_type, body) = await self.respond(method, target.split("?")[0])
+                response = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}",
+                            f"Content-Type: {content_type}",
+                            f"Content-Length: {len(body)}",
+                            "Connection: " + ("keep-alive" if keepalive else "close")]
+                if status == 200 and content_type.startswith("image/"):
+                    response.append("Cache-Control: public, max-age=3600")
+                writer.write(("\r\n".join(response) + "\r\n\r\n").encode("latin-1"))
+                if method != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+                if not keepalive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """Run the server until interrupted"""
+        self.start_pool()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving {self.tiler.input} on http://{host}:{port}/tiles/{{z}}/{{x}}/{{y}}{self.tiler.tilesuffix}."
+              f"{self.tiler.tile_format(self.tiler.tmaxz)[1]}")
+        print(f"  zoom {self.tiler.tminz}-{self.tiler.tmaxz}, disk cache {self.tiler.output}/, "
+              f"memory cache {self.cache.maxbytes // (1024 * 1024)} MB, {self.processes} rendering processes")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+def parse_arguments():
+    """Command line options"""
+    parser = argparse.ArgumentParser(description="Render the map tiles on demand from the source map")
+    parser.add_argument("source", help="source map (PNG, GeoTIFF, VRT, ...)")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on (default: 127.0.0.1, 0.0.0.0 in a container)")
+    parser.add_argument("--port", type=int, default=8090,
+                        help="port to listen on (default: 8090)")
+    parser.add_argument("--cache-dir", default="tiles",
+                        help="disk cache, a {z}/{x}/{y} tile tree (default: tiles)")
+    parser.add_argument("--cache-mb", type=int, default=256,
+                        help="size of the in-memory tile cache in MB (default: 256)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="rendering processes (default: number of CPUs)")
+    parser.add_argument("-z", "--zoom", default="0-9",
+                        help="zoom levels served (default: 0-9)")
+    parser.add_argument("-r", "--resampling", default="average",
+                        help="resampling as in gdal2tiles.py -r (default: average)")
+    parser.add_argument("--format", default="png",
+                        help="tile format as in gdal2tiles.py --format (default: png)")
+    parser.add_argument("--quality", type=int, default=85,
+                        help="quality of JPEG and WebP tiles (default: 85)")
+    parser.add_argument("--tilesize", type=int, default=256,
+                        help="tile size in pixels as in gdal2tiles.py --tilesize (default: 256)")
+    parser.add_argument("--retina", action="store_true",
+                        help="serve the {y}@2x tiles of gdal2tiles.py --retina")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    tileserver = TileServer(args)
+    try:
+        asyncio.run(tileserver.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print()
+    print(f"Statistics: {json.dumps(tileserver.stats)}")
@@ -271,6 +271,29 @@ app.use(session({
     maxAge: 24 * 60 * 60 * 1000 // 24 hours
   }
 }));
+// Map tiles rendered on demand by MapGenerator/tile-server.py (optional)
+if (process.env.TILE_SERVER_URL) {
+  const tileServer = new URL(process.env.TILE_SERVER_URL);
+  app.use('/assets/tiles', (req, res) => {
+    const proxyReq = http.request({
+      hostname: tileServer.hostname,
+      port: tileServer.port,
+      path: '/tiles' + req.url,
+      method: req.method
+    }, (proxyRes) => {
+      res.writeHead(proxyRes.statusCode, proxyRes.headers);
+      proxyRes.pipe(res);
+    });
+    proxyReq.on('error', (error) => {
+      console.error('Tile server error:', error.message);
+      if (!res.headersSent) {
+        res.status(502).end();
+      }
+    });
+    proxyReq.end();
+  });
+}
+
 app.use(express.static(path.join(__dirname)));
 
 // Serve assets folder